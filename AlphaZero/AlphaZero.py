@@ -1,11 +1,17 @@
 from .Players import RandomPlayer, GreedyPlayer, AlphaZeroPlayer
+from .SelfPlay import configure_worker, connect_worker, server_self_play, self_play_episode, SelfPlayWorkers
+from .InferenceServer import InferenceServer
 from multiprocessing import Pool
 from .MonteCarlo import MCTS
+from .ReplayBuffer import ReplayBuffer
+from .Scheduler import worker_cpu_sets
 from .CNNET import CNNET
+from .Inference import checkpoint_args, export_quantized
 from tqdm import tqdm
-import numpy as np
 import logging
 import torch
+import multiprocessing
+import time
 import csv
 import os
 
@@ -14,49 +20,18 @@ class AlphaZero:
     def __init__(self, game, args):
         self.game = game
         self.args = args
-        self.model_name = f"{game.name}{game.n}x{game.m}"
+        self.model_name = game.model_name
         self.win_rates = {'RandomPlayer': 0.0, 'GreedyPlayer': 0.0, 'AlphaZeroPlayer': 0.0}
         self.cnnet = CNNET(game, args).to(args['device'])
         self.mcts = MCTS(game, self.cnnet, self.args)
+        self.buffer = None
         self.iter = None
 
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
 
     def self_play(self):
-        # Create a copy of the game to play out the self-play episode
-        self_play_game = self.game.clone()
-
-        # Create a new MCTS instance for self-play
-        self_play_mcts = MCTS(self_play_game, self.cnnet, self.args)
-
-        training_data = []
-
-        while not self_play_game.is_terminal():
-            action_prob = self_play_mcts.search()
-            training_data.append(
-                (self_play_game.board * self_play_game.player_turn, action_prob, self_play_game.player_turn))
-            # print(np.array(self_play_game.board))
-            # print()
-
-            # Apply the selected action to the state
-            action = np.random.choice(self_play_game.getActionSize(), p=action_prob)
-            self_play_game.apply_action(action)
-
-        # Collect the training data for the self-play episode
-        adjusted_training_data = []
-        for hist_neutral_state, hist_action_probs, hist_player in training_data:
-            hist_outcome = self_play_game.winner if hist_player == self.game.player_turn else -self_play_game.winner
-            augmented_states = [hist_neutral_state]
-
-            for augmented_state in augmented_states:
-                augmented_state = np.array(augmented_state)
-                if len(augmented_state) == 0:
-                    continue
-                adjusted_training_data.append(
-                    (self.game.get_encoded_board(augmented_state), hist_action_probs, hist_outcome))
-
-        return adjusted_training_data
+        return self_play_episode(self.game, self.args, self.cnnet)
 
     def learn(self):
         """
@@ -69,23 +44,177 @@ class AlphaZero:
             print(f"Limit {self.args['iterations_limit']} iteractions reached!!!!")
             return
 
-        with Pool(self.args["num_processes"]) as pool:
+        if self.buffer is None:
+            directory = f"{self.args['best_model_dir']}{self.model_name}/" if self.args['replay_buffer_persistent'] else None
+            self.buffer = ReplayBuffer(self.game, self.args['replay_buffer_size'], self.args['replay_policy_width'],
+                                       directory)
+
+        if self.args['trainer_threads'] is not None:
+            torch.set_num_threads(self.args['trainer_threads'])
+
+        if self.args['async_training']:
+            return self.learn_async()
+        if self.args['self_play_workers']:
+            return self.learn_from_workers()
+
+        server = None
+        cpu_sets = worker_cpu_sets(self.args)
+        pool_args = dict(initializer=configure_worker, initargs=(self.args, cpu_sets))
+        if self.args['inference_server']:
+            # The workers send their states to the model of this process instead of each holding a copy
+            server = InferenceServer(self.cnnet, self.args['num_processes'], self.args['mcts_batch_size'],
+                                     self.args['inference_batch_size'], self.args['inference_timeout'])
+            free_clients = multiprocessing.Queue()
+            for client_id in range(self.args['num_processes']):
+                free_clients.put(client_id)
+            pool_args = dict(initializer=connect_worker,
+                             initargs=(server.clients, free_clients, self.game, self.args, cpu_sets))
+            server.start()
+
+        with Pool(self.args["num_processes"], **pool_args) as pool:
             try:
                 while self.iter < self.args["iterations_limit"]:
                     self.iter += self.args['num_episodes']
                     episodes_bar = tqdm(total=self.args["num_episodes"], desc=f'Iteration {self.iter}: Episodes',
                                         position=0, leave=True)
-                    for episode in range(self.args["num_episodes"]):
-                        training_data = pool.apply_async(self.self_play).get()
-                        self.cnnet.train_model(training_data)
-                        episodes_bar.update(1)
+                    if server is None:
+                        for episode in range(self.args["num_episodes"]):
+                            training_data = pool.apply_async(self_play_episode, (self.game, self.args, self.cnnet)).get()
+                            self.buffer.add_training_data(training_data, self.cnnet.version)
+                            self.cnnet.train_replay(self.buffer, len(training_data))
+                            episodes_bar.update(1)
+                    else:
+                        # Episodes run in every worker at once, their evaluations batched together by the server
+                        for training_data in pool.imap_unordered(server_self_play, range(self.args["num_episodes"])):
+                            self.buffer.add_training_data(training_data, self.cnnet.version)
+                            with server.lock:
+                                self.cnnet.train_replay(self.buffer, len(training_data))
+                            episodes_bar.update(1)
 
                     self.evaluate_and_save_model()
                     episodes_bar.close()
 
+                    if self.args["training_verbose"] and self.cnnet.cache is not None:
+                        cache = self.cnnet.cache
+                        self.logger.info(f"Evaluation cache: {cache.hits} hits, {cache.misses} misses, "
+                                         f"{cache.evictions} evictions, {len(cache)} entries")
+                    if self.args["training_verbose"] and server is not None:
+                        stats = server.stats()
+                        self.logger.info(f"Inference server: {stats['requests']} requests in {stats['batches']} batches "
+                                         f"of {stats['batch_size']:.1f} states, queue depth {stats['queue_depth']:.1f}, "
+                                         f"latency p50 {stats['latency_p50']:.2f} ms, p90 {stats['latency_p90']:.2f} ms, "
+                                         f"p99 {stats['latency_p99']:.2f} ms")
+
                 print(f"Limit {self.args['iterations_limit']} iteractions reached!!!!")
             except Exception as e:
                 print(f"An error occurred: {e}")
+            finally:
+                if server is not None:
+                    server.stop()
+
+    def learn_from_workers(self):
+        """
+        Learning loop for AlphaZero with persistent self-play workers, which keep playing while the model trains
+        and receive its new weights after every training step
+        """
+        workers = SelfPlayWorkers(self.game, self.args, self.cnnet, self.args['num_processes'],
+                                   worker_cpu_sets(self.args))
+        try:
+            while self.iter < self.args["iterations_limit"]:
+                self.iter += self.args['num_episodes']
+                episodes_bar = tqdm(total=self.args["num_episodes"], desc=f'Iteration {self.iter}: Episodes',
+                                    position=0, leave=True)
+                for episode in range(self.args["num_episodes"]):
+                    training_data, version = workers.get()
+                    self.buffer.add_training_data(training_data, version)
+                    self.cnnet.train_replay(self.buffer, len(training_data))
+                    workers.publish(self.cnnet)
+                    episodes_bar.update(1)
+
+                self.evaluate_and_save_model()
+                episodes_bar.close()
+
+            print(f"Limit {self.args['iterations_limit']} iteractions reached!!!!")
+        except Exception as e:
+            print(f"An error occurred: {e}")
+        finally:
+            workers.stop()
+
+    def learn_async(self):
+        """
+        Asynchronous learning loop for AlphaZero: persistent self-play workers (the actors) play continuously while this
+        process (the learner) trains on batches sampled from a buffer of their latest positions, at most
+        args['train_sample_ratio'] trained samples per generated sample. Every args['num_episodes'] episodes
+        a snapshot of the model is evaluated and saved by a separate process, and so are the last weights.
+        """
+        workers = SelfPlayWorkers(self.game, self.args, self.cnnet, self.args['num_processes'],
+                                   worker_cpu_sets(self.args))
+        generated_samples = 0
+        trained_samples = 0
+        next_evaluation = self.iter + self.args['num_episodes']
+        evaluation = None
+        evaluated = self.iter
+        finished = False
+
+        # Statistics since the last log
+        start = time.perf_counter()
+        episodes, samples, steps, staleness = 0, 0, 0, 0
+
+        try:
+            while self.iter < self.args["iterations_limit"]:
+                # Wait for the actors when the learner is ahead of the ratio
+                learner_ahead = trained_samples >= self.args['train_sample_ratio'] * generated_samples
+                for training_data, version in workers.poll(block=learner_ahead or len(self.buffer) == 0):
+                    self.buffer.add_training_data(training_data, version)
+                    generated_samples += len(training_data)
+                    samples += len(training_data)
+                    episodes += 1
+                    self.iter += 1
+
+                if trained_samples < self.args['train_sample_ratio'] * generated_samples and len(self.buffer) > 0:
+                    staleness += self.cnnet.train_replay(self.buffer, self.args['batch_size'])
+                    workers.publish(self.cnnet)
+                    trained_samples += self.args['batch_size']
+                    steps += 1
+
+                if self.iter >= next_evaluation and (evaluation is None or not evaluation.is_alive()):
+                    evaluation = self.start_evaluation()
+                    evaluated = self.iter
+                    next_evaluation = self.iter + self.args['num_episodes']
+
+                    if self.args["training_verbose"]:
+                        elapsed = time.perf_counter() - start
+                        self.logger.info(f"Actors: {episodes / elapsed:.2f} episodes/sec, {samples / elapsed:.1f} "
+                                         f"samples/sec; learner: {steps / elapsed:.2f} steps/sec, staleness "
+                                         f"{staleness / max(steps, 1):.2f} versions")
+                        start = time.perf_counter()
+                        episodes, samples, steps, staleness = 0, 0, 0, 0
+
+            finished = True
+            print(f"Limit {self.args['iterations_limit']} iteractions reached!!!!")
+        except Exception as e:
+            print(f"An error occurred: {e}")
+        finally:
+            workers.stop()
+            self.buffer.flush()
+            if evaluation is not None:
+                evaluation.join()
+            if finished and evaluated < self.iter:
+                # The last weights are evaluated and saved too, once the workers no longer need the CPU
+                self.start_evaluation().join()
+
+    def start_evaluation(self):
+        """
+        Starts the process evaluating and saving a snapshot of the model at the current iteration. The buffer is only
+        ever written by the learner, so it is flushed here, and the evaluation gets a copy of the weights.
+
+        Returns: the process
+        """
+        self.buffer.flush()
+        weights = {key: tensor.detach().cpu().clone() for key, tensor in self.cnnet.state_dict().items()}
+        evaluation = multiprocessing.Process(target=evaluate_snapshot, args=(self.game, self.args, weights, self.iter))
+        evaluation.start()
+        return evaluation
 
     def validation_games(self, player1, player2, model_turn):
         total_wins = 0
@@ -135,6 +264,11 @@ class AlphaZero:
         save_dir = f"{self.args['best_model_dir']}{self.model_name}/"
         os.makedirs(save_dir, exist_ok=True)
         torch.save(self.cnnet.state_dict(), f"{save_dir}model.tar")
+        if self.args['quantized_inference']:
+            # The int8 variant the players of CPU-only machines run on
+            export_quantized(self.game, self.args, f"{save_dir}model.tar")
+        if self.buffer is not None:
+            self.buffer.flush()
         self.save_best_win_rates()
 
     def save_best_win_rates(self):
@@ -142,8 +276,8 @@ class AlphaZero:
         csv_file = f"{self.args['best_model_dir']}{self.model_name}/win_rates.csv"
         with open(csv_file, 'a', newline='') as f:
             writer = csv.writer(f)
-            # If it's the first iteration, write the header
-            if self.iter == self.args['num_episodes']:
+            # If it's the first row, write the header (asynchronous training evaluates at any iteration)
+            if f.tell() == 0:
                 writer.writerow(['n_iter', 'RandomPlayer', 'GreedyPlayer', 'AlphaZeroBaseline'])
             # Write the best win rates
             writer.writerow([self.iter, self.win_rates['RandomPlayer'], self.win_rates['GreedyPlayer'],
@@ -152,11 +286,21 @@ class AlphaZero:
     def load_model(self):
         models_dir = f"{self.args['best_model_dir']}{self.model_name}/"
         os.makedirs(models_dir, exist_ok=True)
-        models = os.listdir(models_dir)
-        if len(models) == 0:
+        # The replay buffer can be there before any model was saved
+        if not os.path.exists(f"{models_dir}win_rates.csv"):
             return False
         self.iter = self.get_last_iter(f"{models_dir}win_rates.csv")
         model_path = f"{models_dir}model.tar"
+        if os.path.exists(model_path):
+            state_dict = torch.load(model_path, map_location='cpu', mmap=True, weights_only=True)
+            architecture = {key: value for key, value in checkpoint_args(state_dict, self.args).items()
+                            if self.args[key] != value}
+            if architecture:
+                # The training goes on with the architecture of the checkpoint
+                self.args.update(architecture)
+                self.logger.info(f"Loading a checkpoint of the {self.args['network']} network with {architecture}")
+                self.cnnet = CNNET(self.game, self.args).to(self.args['device'])
+                self.mcts = MCTS(self.game, self.cnnet, self.args)
         return self.cnnet.load_model(model_path)
 
     @staticmethod
@@ -167,3 +311,15 @@ class AlphaZero:
             last_row = rows[-1]
             n_iter = int(last_row[0])
             return n_iter
+
+
+def evaluate_snapshot(game, args, weights, n_iter):
+    """
+    Process evaluating and saving a snapshot of the model at iteration n_iter, with the weights it was given,
+    while the learner keeps training.
+    """
+    configure_worker(args)
+    snapshot = AlphaZero(game, args)
+    snapshot.cnnet.load_state_dict(weights)
+    snapshot.iter = n_iter
+    snapshot.evaluate_and_save_model()
@@ -0,0 +1,185 @@
+from .TranspositionTable import TranspositionTable
+import numpy as np
+
+
+class ArrayTree:
+    """
+    Search tree stored in preallocated NumPy arrays instead of one Node object per child.
+    A node is an index into the arrays and the children of a node are stored contiguously,
+    starting at first_child[node], so selection is a single vectorized argmax over that slice.
+    """
+
+    def __init__(self, args, capacity=1024):
+        self.args = args
+        self.size = 0
+        self.visit_count = np.zeros(capacity, dtype=np.int64)
+        self.value_sum = np.zeros(capacity, dtype=np.float64)
+        self.prior = np.zeros(capacity, dtype=np.float64)
+        self.first_child = np.zeros(capacity, dtype=np.int64)
+        self.num_children = np.zeros(capacity, dtype=np.int64)
+        self.parent = np.full(capacity, -1, dtype=np.int64)
+        self.action_taken = np.full(capacity, -1, dtype=np.int64)
+        # Hash of the state of each node, children only get it when the search first reaches them
+        self.keys = [None] * capacity
+        self.table = TranspositionTable(args['transposition_table_size']) if args['transposition_table_size'] > 0 else None
+
+    def reserve(self, size):
+        capacity = len(self.keys)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name in ['visit_count', 'value_sum', 'prior', 'first_child', 'num_children', 'parent', 'action_taken']:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        self.parent[len(self.keys):] = -1
+        self.action_taken[len(self.keys):] = -1
+        self.keys.extend([None] * (capacity - len(self.keys)))
+
+    def new_root(self, key):
+        self.keys[:self.size] = [None] * self.size
+        if self.table is not None:
+            self.table.clear()
+        self.size = 1
+        self.visit_count[0] = 1
+        self.value_sum[0] = 0
+        self.prior[0] = 0
+        self.num_children[0] = 0
+        self.parent[0] = -1
+        self.action_taken[0] = -1
+        self.keys[0] = key
+        return 0
+
+    def get_action(self, node):
+        return int(self.action_taken[node])
+
+    def get_key(self, node):
+        return self.keys[node]
+
+    def set_key(self, node, key):
+        self.keys[node] = key
+
+    def get_children(self, node):
+        start = self.first_child[node]
+        return range(start, start + self.num_children[node])
+
+    def get_child(self, node, action):
+        start = self.first_child[node]
+        children = np.flatnonzero(self.action_taken[start:start + self.num_children[node]] == action)
+        return start + int(children[0]) if len(children) > 0 else None
+
+    def reroot(self, node):
+        """
+        Compacts the subtree of node to the front of the arrays, with node as the new root,
+        releasing every other node of the tree.
+        """
+        order = [node]
+        parent = [-1]
+        first_child = [0]
+        # Children shared between transpositions are copied once, at their first owner
+        new_slices = {}
+        i = 0
+        while i < len(order):
+            start = self.first_child[order[i]]
+            num_children = self.num_children[order[i]]
+            if num_children > 0:
+                if start not in new_slices:
+                    new_slices[start] = len(order)
+                    order.extend(range(start, start + num_children))
+                    parent.extend([i] * num_children)
+                    first_child.extend([0] * num_children)
+                first_child[i] = new_slices[start]
+            i += 1
+
+        order = np.array(order)
+        size = len(order)
+        self.reserve(size)
+        for name in ['visit_count', 'value_sum', 'prior', 'num_children', 'action_taken']:
+            values = getattr(self, name)
+            values[:size] = values[order]
+        self.parent[:size] = parent
+        self.first_child[:size] = first_child
+        keys = [self.keys[i] for i in order.tolist()]
+        self.keys[:self.size] = [None] * self.size
+        self.keys[:size] = keys
+        self.size = size
+
+        if self.table is not None:
+            self.table.clear()
+            for new, key in enumerate(keys):
+                if key is not None and self.num_children[new] > 0:
+                    self.table.put(key, new)
+        return 0
+
+    def is_expanded(self, node):
+        return self.num_children[node] > 0
+
+    def select(self, node):
+        start = self.first_child[node]
+        end = start + self.num_children[node]
+        visit_count = self.visit_count[start:end]
+        q_value = np.where(visit_count > 0,
+                           1 - (self.value_sum[start:end] / np.maximum(visit_count, 1) + 1) / 2, 0)
+        ucb = q_value + self.args['UCB_exploration_weight'] * (np.sqrt(self.visit_count[node]) / (visit_count + 1)) * self.prior[start:end]
+        return start + int(np.argmax(ucb))
+
+    def expand(self, node, policy):
+        actions = np.flatnonzero(policy > 0)
+        start = self.size
+        end = start + len(actions)
+        self.reserve(end)
+
+        self.visit_count[start:end] = 0
+        self.value_sum[start:end] = 0
+        self.prior[start:end] = policy[actions]
+        self.num_children[start:end] = 0
+        self.parent[start:end] = node
+        self.action_taken[start:end] = actions
+
+        self.first_child[node] = start
+        self.num_children[node] = len(actions)
+        self.size = end
+        if self.table is not None:
+            self.table.put(self.keys[node], node)
+
+    def transpose(self, node):
+        """
+        Shares the children of an expanded node of the same position, found in the transposition table.
+
+        Returns: the value of that position, or None when the table has no expanded node for it
+        """
+        if self.table is None:
+            return None
+        entry = self.table.get(self.keys[node])
+        if entry is None or self.num_children[entry] == 0:
+            return None
+        self.first_child[node] = self.first_child[entry]
+        self.num_children[node] = self.num_children[entry]
+        return self.value_sum[entry] / self.visit_count[entry]
+
+    def add_dirichlet_noise(self, node, epsilon, alpha):
+        start = self.first_child[node]
+        end = start + self.num_children[node]
+        self.prior[start:end] = (1 - epsilon) * self.prior[start:end] + epsilon * np.random.dirichlet([alpha] * (end - start))
+
+    def backpropagate(self, path, value):
+        for node in reversed(path):
+            self.value_sum[node] += value
+            self.visit_count[node] += 1
+            value = -value
+
+    def add_virtual_loss(self, path, virtual_loss):
+        self.visit_count[path] += virtual_loss
+        self.value_sum[path] += virtual_loss
+
+    def revert_virtual_loss(self, path, virtual_loss):
+        self.add_virtual_loss(path, -virtual_loss)
+
+    def get_action_visits(self, node, action_size):
+        start = self.first_child[node]
+        end = start + self.num_children[node]
+        action_visits = np.zeros(action_size)
+        action_visits[self.action_taken[start:end]] = self.visit_count[start:end]
+        return action_visits
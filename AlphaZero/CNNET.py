@@ -1,31 +1,90 @@
+from .EvaluationCache import EvaluationCache
+from .Minibatches import Prefetcher, minibatches
 import torch.nn.functional as F
 import torch.nn as nn
 import numpy as np
-import random
 import torch
 import os
 
 
+def masked_log_softmax(logits, legal_masks):
+    """
+    Returns: the log-probabilities of the policies of logits restricted to the actions of legal_masks, -inf elsewhere
+    """
+    return torch.log_softmax(logits.masked_fill(legal_masks == 0, -np.inf), dim=1)
+
+
+class ResidualBlock(nn.Module):
+    def __init__(self, channels):
+        super(ResidualBlock, self).__init__()
+        self.conv1 = nn.Conv2d(channels, channels, kernel_size=3, stride=1, padding=1, bias=False)
+        self.bn1 = nn.BatchNorm2d(channels)
+        self.conv2 = nn.Conv2d(channels, channels, kernel_size=3, stride=1, padding=1, bias=False)
+        self.bn2 = nn.BatchNorm2d(channels)
+
+    def forward(self, x):
+        y = F.relu(self.bn1(self.conv1(x)))
+        y = self.bn2(self.conv2(y))
+        return F.relu(x + y)
+
+
 class CNNET(nn.Module):
-    def __init__(self, game, args):
+    """
+    Policy and value network, with one of two architectures selected by args['network']:
+        legacy: three convolutions and two fully connected layers, the value being the sum of the policy logits
+        residual: a tower of args['residual_blocks'] residual blocks of args['residual_channels'] channels,
+                  with a policy head (1x1 convolution, fully connected layer) and a value head
+                  (1x1 convolution, fully connected layer of args['head_width'] units, tanh output)
+    """
+
+    def __init__(self, game, args, training=True):
         super(CNNET, self).__init__()
         self.game = game
         self.args = args
         self.n = game.n
         self.m = game.m
         self.device = self.args['device']
-        # Define your convolutional layers
-        self.conv1 = nn.Conv2d(3, 64, kernel_size=3, stride=1, padding=1)
-        self.conv2 = nn.Conv2d(64, 128, kernel_size=3, stride=1, padding=1)
-        self.conv3 = nn.Conv2d(128, 256, kernel_size=3, stride=1, padding=1)
-
-        # Define fully connected layers
-        self.fc1 = nn.Linear(256 * self.n * self.m, 512)
-        self.fc2 = nn.Linear(512, game.getActionSize())
-
-        self.optimizer = torch.optim.Adam(self.parameters(), lr=self.args['learning_rate'])
+        self.network = self.args['network']
+        if self.network == 'legacy':
+            # Define your convolutional layers
+            self.conv1 = nn.Conv2d(3, 64, kernel_size=3, stride=1, padding=1)
+            self.conv2 = nn.Conv2d(64, 128, kernel_size=3, stride=1, padding=1)
+            self.conv3 = nn.Conv2d(128, 256, kernel_size=3, stride=1, padding=1)
+
+            # Define fully connected layers
+            self.fc1 = nn.Linear(256 * self.n * self.m, 512)
+            self.fc2 = nn.Linear(512, game.getActionSize())
+        else:
+            channels = self.args['residual_channels']
+            self.stem = nn.Sequential(nn.Conv2d(3, channels, kernel_size=3, stride=1, padding=1, bias=False),
+                                      nn.BatchNorm2d(channels), nn.ReLU())
+            self.tower = nn.Sequential(*[ResidualBlock(channels) for _ in range(self.args['residual_blocks'])])
+            self.policy_conv = nn.Sequential(nn.Conv2d(channels, 2, kernel_size=1, bias=False), nn.BatchNorm2d(2),
+                                             nn.ReLU())
+            self.policy_fc = nn.Linear(2 * self.n * self.m, game.getActionSize())
+            self.value_conv = nn.Sequential(nn.Conv2d(channels, 1, kernel_size=1, bias=False), nn.BatchNorm2d(1),
+                                            nn.ReLU())
+            self.value_fc1 = nn.Linear(self.n * self.m, self.args['head_width'])
+            self.value_fc2 = nn.Linear(self.args['head_width'], 1)
+
+        # Models that only play have no optimizer, whose construction alone takes a good part of the startup
+        self.optimizer = torch.optim.Adam(self.parameters(), lr=self.args['learning_rate']) if training else None
+        # Batch normalization uses its running statistics except during the training steps
+        self.eval()
+
+        # Bumped on every change of the weights, which invalidates the evaluation cache
+        self.version = 0
+        # Dense policy targets of a training batch, filled from the sparse ones of the replay buffer
+        self.policy_targets = None
+        self.cache = EvaluationCache(game, self.args['evaluation_cache_mb']) if self.args['evaluation_cache_mb'] > 0 else None
 
     def forward(self, x):
+        if self.network != 'legacy':
+            x = self.tower(self.stem(x))
+            policy = self.policy_fc(self.policy_conv(x).flatten(1))
+            value = torch.tanh(self.value_fc2(F.relu(self.value_fc1(self.value_conv(x).flatten(1)))))
+            return policy, value
+
         # Input x should be the game state
         x = F.relu(self.conv1(x))
         x = F.relu(self.conv2(x))
@@ -37,37 +96,138 @@ class CNNET(nn.Module):
         x = F.relu(self.fc1(x))
         x = self.fc2(x)
 
-        # Compute the policy and value
-        policy = F.softmax(x, dim=1)
+        # The policy logits and the value
         value = x.sum(dim=1, keepdim=True)  # keep dimensions to match with value_targets
 
-        return policy, value
+        return x, value
+
+    def policy_layer(self):
+        """
+        Returns: the linear layer giving the policy logits, of the legacy or the residual network
+        """
+        return self.fc2 if self.args['network'] == 'legacy' else self.policy_fc
+
+    @torch.no_grad()
+    def forward_numpy(self, states):
+        policy, value = self(torch.as_tensor(states, dtype=torch.float32, device=self.device))
+        return policy.cpu().numpy(), value.squeeze(1).cpu().numpy()
+
+    def evaluate(self, states):
+        """
+        Evaluates encoded states of shape (B, 3, n, m), through the evaluation cache when there is one.
+
+        Returns: the policy logits and values of the states, as NumPy arrays
+        """
+        if self.cache is None:
+            return self.forward_numpy(states)
+        return self.cache.evaluate(self, states)
+
+    @torch.no_grad()
+    def predict(self, states, legal_masks):
+        """
+        Evaluates encoded states of shape (B, 3, n, m) with the masks of their legal actions, of shape (B, A),
+        the softmax of the policies and the masking done in a single pass over the logits.
+
+        Returns: the log-probabilities of the actions (-inf for the illegal ones) and the values, as NumPy arrays
+        """
+        if self.cache is not None:
+            logits, values = self.cache.evaluate(self, states)
+            return masked_log_softmax(torch.from_numpy(logits), torch.as_tensor(legal_masks)).numpy(), values
+        logits, values = self(torch.as_tensor(states, dtype=torch.float32, device=self.device))
+        log_policies = masked_log_softmax(logits, torch.as_tensor(legal_masks, device=self.device))
+        return log_policies.cpu().numpy(), values.squeeze(1).cpu().numpy()
+
+    def prefetch(self, batches):
+        """
+        Returns: the batches, produced args['prefetch_batches'] ahead by a background thread and pinned for a GPU
+        """
+        pin_memory = self.device is not None and torch.device(self.device).type == 'cuda'
+        return Prefetcher(batches, self.args['prefetch_batches'], pin_memory)
 
     def train_model(self, training_data):
-        random.shuffle(training_data)
-        for batchIdx in range(0, len(training_data), self.args['batch_size']):
-            sample = training_data[batchIdx:batchIdx + self.args['batch_size']]
-            state, policy_targets, value_targets = zip(*sample)
-
-            state, policy_targets, value_targets = np.array(state), np.array(policy_targets), np.array(value_targets).reshape(-1, 1)
-
-            state = torch.tensor(state, dtype=torch.float32, device=self.device)
-            policy_targets = torch.tensor(policy_targets, dtype=torch.float32, device=self.device)
-            value_targets = torch.tensor(value_targets, dtype=torch.float32, device=self.device)
-
-            out_policy, out_value = self(state)
-
-            policy_loss = F.cross_entropy(out_policy, policy_targets)
-            value_loss = F.mse_loss(out_value, value_targets)
-            loss = policy_loss + value_loss
-
-            self.optimizer.zero_grad()
-            loss.backward()
-            self.optimizer.step()
+        """
+        Trains on a list of (encoded state, policy, outcome) samples for args['train_epochs'] epochs, or
+        args['train_steps'] batches when set. The samples are stacked once into contiguous tensors and the batches
+        gathered from them by index.
+        """
+        states, policy_targets, value_targets = zip(*training_data)
+        tensors = (torch.from_numpy(np.array(states, dtype=np.float32)),
+                   torch.from_numpy(np.array(policy_targets, dtype=np.float32)),
+                   torch.from_numpy(np.array(value_targets, dtype=np.float32)))
+        batches = minibatches(tensors, self.args['batch_size'], self.args['train_epochs'], self.args['train_steps'])
+        for state, policy_targets, value_targets in self.prefetch(batches):
+            self.train_batch(state, policy_targets, value_targets)
+        self.version += 1
+
+    def train_replay(self, buffer, num_samples):
+        """
+        Trains on args['train_epochs'] times num_samples positions sampled from a replay buffer (at most
+        args['train_steps'] batches when set), in batches of args['batch_size'].
+
+        Returns: the mean number of versions the trained positions are behind the model
+        """
+        num_samples *= self.args['train_epochs']
+        if self.args['train_steps'] > 0:
+            num_samples = min(num_samples, self.args['train_steps'] * self.args['batch_size'])
+        staleness = 0
+        batches = buffer.batches(self.args['batch_size'], num_samples, self.args['replay_half_life'])
+        for state, policy_indices, policy_values, value_targets, versions in self.prefetch(batches):
+            self.train_batch(state, self.densify(policy_indices, policy_values), value_targets)
+            staleness += np.sum(self.version - versions)
+        self.version += 1
+        return staleness / max(num_samples, 1)
+
+    def densify(self, policy_indices, policy_values):
+        """
+        Scatters sparse policy targets into the preallocated tensor of the policy targets of a batch.
+
+        Returns: the dense policy targets, a view of that tensor valid until the next call
+        """
+        if self.policy_targets is None or len(self.policy_targets) < len(policy_indices):
+            self.policy_targets = torch.zeros(len(policy_indices), self.game.getActionSize(), device=self.device)
+        policy_targets = self.policy_targets[:len(policy_indices)]
+        policy_targets.zero_()
+        # Padding entries add 0, wherever they point
+        policy_targets.scatter_add_(1, torch.from_numpy(policy_indices.astype(np.int64)).to(self.device),
+                                    torch.from_numpy(policy_values.astype(np.float32)).to(self.device))
+        return policy_targets
+
+    def train_batch(self, state, policy_targets, value_targets):
+        """
+        Takes an optimizer step on a batch of encoded states and their policy and value targets,
+        as NumPy arrays or tensors.
+        """
+        state = torch.as_tensor(state, dtype=torch.float32, device=self.device)
+        policy_targets = torch.as_tensor(policy_targets, dtype=torch.float32, device=self.device)
+        value_targets = torch.as_tensor(value_targets.reshape(-1, 1), dtype=torch.float32, device=self.device)
+
+        self.train()
+        out_logits, out_value = self(state)
+
+        policy_loss = F.cross_entropy(out_logits, policy_targets)
+        value_loss = F.mse_loss(out_value, value_targets)
+        loss = policy_loss + value_loss
+
+        self.optimizer.zero_grad()
+        loss.backward()
+        self.optimizer.step()
+        self.eval()
 
     def load_model(self, model_path):
         if os.path.exists(model_path):
-            self.load_state_dict(torch.load(str(model_path), map_location=self.args["device"]))
+            self.load_weights(torch.load(str(model_path), map_location=self.args["device"]))
             return True
         else:
             return False
+
+    def load_weights(self, state_dict, assign=False):
+        """
+        Loads the weights of a saved model, taking over its tensors instead of copying them when assign is set.
+        """
+        for layer in ['fc2', 'policy_fc']:
+            if f'{layer}.bias' in state_dict and state_dict[f'{layer}.bias'].shape[0] != self.game.getActionSize():
+                # Saved with the legacy encoding of the Ataxx actions
+                for key in [f'{layer}.weight', f'{layer}.bias']:
+                    state_dict[key] = self.game.convert_legacy_actions(state_dict[key])
+        self.load_state_dict(state_dict, assign=assign)
+        self.version += 1
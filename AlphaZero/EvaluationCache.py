@@ -0,0 +1,86 @@
+from collections import OrderedDict
+import numpy as np
+
+
+class EvaluationCache:
+    """
+    LRU cache of model evaluations, keyed by the canonical form of the board under its symmetries,
+    so every rotation or reflection of an evaluated position is a hit.
+    Policy logits are stored in the canonical orientation and permuted back to the orientation of each query.
+    """
+
+    def __init__(self, game, max_megabytes):
+        self.symmetries = game.get_symmetries()
+        self.board_indices = np.stack([board_index for board_index, _ in self.symmetries])
+        self.inverse_action_indices = [np.argsort(action_index) for _, action_index in self.symmetries]
+        # Key, policy (float32) and value of each entry
+        entry_bytes = game.n * game.m + 4 * game.getActionSize() + 8
+        self.capacity = max(1, max_megabytes * 2 ** 20 // entry_bytes)
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getstate__(self):
+        # Copies of the model sent to other processes start with an empty cache
+        state = self.__dict__.copy()
+        state['entries'] = OrderedDict()
+        return state
+
+    def clear(self):
+        self.entries.clear()
+
+    def canonicalize(self, states):
+        """
+        Returns: the key of each encoded state and the index of the symmetry that maps it to its canonical form
+        """
+        boards = (states[:, 2] - states[:, 0]).astype(np.int8).reshape(len(states), -1)
+        keys = []
+        symmetry_indices = []
+        for transformed in boards[:, self.board_indices]:
+            candidates = [candidate.tobytes() for candidate in transformed]
+            symmetry_index = min(range(len(candidates)), key=candidates.__getitem__)
+            keys.append(candidates[symmetry_index])
+            symmetry_indices.append(symmetry_index)
+        return keys, symmetry_indices
+
+    def evaluate(self, model, states):
+        """
+        Evaluates encoded states of shape (B, 3, n, m), running the model only on the positions not in the cache.
+
+        Returns: the policy logits and values of the states, as NumPy arrays
+        """
+        if self.version != model.version:
+            # The weights changed since the entries were computed
+            self.clear()
+            self.version = model.version
+
+        keys, symmetry_indices = self.canonicalize(states)
+        results = [self.entries.get(key) for key in keys]
+        misses = [i for i, result in enumerate(results) if result is None]
+        self.hits += len(states) - len(misses)
+        self.misses += len(misses)
+        for key, result in zip(keys, results):
+            if result is not None:
+                self.entries.move_to_end(key)
+
+        if len(misses) > 0:
+            canonical_states = np.ascontiguousarray(np.stack([
+                states[i].reshape(3, -1)[:, self.board_indices[symmetry_indices[i]]].reshape(states[i].shape)
+                for i in misses]))
+            policies, values = model.forward_numpy(canonical_states)
+            for i, policy, value in zip(misses, policies, values):
+                results[i] = (policy, value)
+                self.entries[keys[i]] = results[i]
+                if len(self.entries) > self.capacity:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+
+        policies = np.stack([policy[self.inverse_action_indices[symmetry_index]]
+                             for (policy, _), symmetry_index in zip(results, symmetry_indices)])
+        values = np.array([value for _, value in results], dtype=np.float32)
+        return policies, values
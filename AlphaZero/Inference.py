@@ -0,0 +1,108 @@
+from .EvaluationCache import EvaluationCache
+from .CNNET import CNNET, masked_log_softmax
+from torch.ao.quantization import quantize_dynamic
+import torch
+import os
+
+
+def checkpoint_args(state_dict, args):
+    """
+    Returns: args with the architecture of the network whose weights are state_dict
+    """
+    if 'conv1.weight' in state_dict:
+        return dict(args, network='legacy')
+    return dict(args, network='residual',
+                residual_blocks=len({key.split('.')[1] for key in state_dict if key.startswith('tower.')}),
+                residual_channels=state_dict['stem.0.weight'].shape[0],
+                head_width=state_dict['value_fc1.weight'].shape[0])
+
+
+def quantized_path(model_path):
+    return os.path.join(os.path.dirname(str(model_path)), 'model_int8.pt')
+
+
+def export_quantized(game, args, model_path):
+    """
+    Exports the int8 variant of the model saved at model_path next to it: its fully connected layers dynamically
+    quantized to int8 and the whole network frozen into a TorchScript trace, which folds the batch normalizations
+    into the convolutions (these stay in float32, dynamic quantization has no convolutions).
+
+    Returns: the path of the export
+    """
+    network = InferenceModel(game, dict(args, device=None, quantized_inference=False), model_path).network
+    network = quantize_dynamic(network, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    module = torch.jit.freeze(torch.jit.trace(network, torch.zeros(1, 3, game.n, game.m)))
+    path = quantized_path(model_path)
+    torch.jit.save(module, path)
+    return path
+
+
+class InferenceModel:
+    """
+    Trained model of a player, loaded for inference only: the network is built in eval mode without an optimizer
+    or initial weights and takes over the tensors of the checkpoint, memory-mapped from the file.
+    With script set it is frozen into a TorchScript trace.
+    With args['quantized_inference'] set it runs the int8 export of the checkpoint instead, on the CPU,
+    exporting it first when there is none as recent as the checkpoint.
+    Used by MCTS in place of a CNNET.
+    """
+
+    def __init__(self, game, args, model_path, script=False):
+        self.game = game
+        self.n = game.n
+        self.m = game.m
+        self.device = args['device']
+        state_dict = torch.load(str(model_path), map_location='cpu', mmap=True, weights_only=True)
+        # The architecture is the one the checkpoint was saved with, whatever args says
+        self.args = checkpoint_args(state_dict, args)
+        if self.args['quantized_inference']:
+            # The quantized kernels only run on the CPU
+            self.device = torch.device('cpu')
+            path = quantized_path(model_path)
+            if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(model_path):
+                export_quantized(game, args, model_path)
+            self.network = None
+            self.module = torch.jit.load(path, map_location='cpu')
+        else:
+            with torch.device('meta'):
+                self.network = CNNET(game, self.args, training=False)
+            self.network.load_weights(state_dict, assign=True)
+            self.network.requires_grad_(False)
+            if self.device is not None:
+                self.network.to(self.device)
+            self.module = self.network
+            if script:
+                example = torch.zeros(1, 3, self.n, self.m, device=self.device)
+                self.module = torch.jit.freeze(torch.jit.trace(self.network, example))
+        # The weights never change
+        self.version = 0
+        self.cache = EvaluationCache(game, self.args['evaluation_cache_mb']) if self.args['evaluation_cache_mb'] > 0 else None
+
+    @torch.no_grad()
+    def forward_numpy(self, states):
+        policy, value = self.module(torch.as_tensor(states, dtype=torch.float32, device=self.device))
+        return policy.cpu().numpy(), value.squeeze(1).cpu().numpy()
+
+    def evaluate(self, states):
+        """
+        Evaluates encoded states of shape (B, 3, n, m), through the evaluation cache when there is one.
+
+        Returns: the policy logits and values of the states, as NumPy arrays
+        """
+        if self.cache is None:
+            return self.forward_numpy(states)
+        return self.cache.evaluate(self, states)
+
+    @torch.no_grad()
+    def predict(self, states, legal_masks):
+        """
+        Evaluates encoded states of shape (B, 3, n, m) with the masks of their legal actions, like CNNET.predict.
+
+        Returns: the log-probabilities of the actions (-inf for the illegal ones) and the values, as NumPy arrays
+        """
+        if self.cache is not None:
+            logits, values = self.cache.evaluate(self, states)
+            return masked_log_softmax(torch.from_numpy(logits), torch.as_tensor(legal_masks)).numpy(), values
+        logits, values = self.module(torch.as_tensor(states, dtype=torch.float32, device=self.device))
+        log_policies = masked_log_softmax(logits, torch.as_tensor(legal_masks, device=self.device))
+        return log_policies.cpu().numpy(), values.squeeze(1).cpu().numpy()
@@ -0,0 +1,164 @@
+from multiprocessing import shared_memory
+from collections import deque
+import multiprocessing
+import numpy as np
+import threading
+import queue
+import time
+
+
+class InferenceClient:
+    """
+    Handle of a self-play worker to the inference server, used by MCTS in place of the model.
+    States and the masks of their legal actions are written to the shared memory slot of the client and the server
+    writes the log-probabilities of the actions and the values back.
+    """
+
+    def __init__(self, client_id, capacity, requests, ready, buffers, shapes):
+        self.client_id = client_id
+        self.capacity = capacity
+        self.requests = requests
+        self.ready = ready
+        self.buffers = buffers
+        self.shapes = shapes
+        self.arrays = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['arrays'] = None
+        return state
+
+    def slot(self):
+        """
+        Returns: the states, legal masks, policies and values arrays of this client, in shared memory
+        """
+        if self.arrays is None:
+            self.arrays = [np.ndarray(shape, dtype=np.float32, buffer=buffer.buf)[self.client_id]
+                           for buffer, shape in zip(self.buffers, self.shapes)]
+        return self.arrays
+
+    def predict(self, states, legal_masks):
+        """
+        Evaluates encoded states of shape (B, 3, n, m) with the masks of their legal actions on the server,
+        in requests of at most capacity states.
+
+        Returns: the log-probabilities of the actions and the values of the states, as NumPy arrays
+        """
+        slot_states, slot_masks, slot_policies, slot_values = self.slot()
+        policies = []
+        values = []
+        for start in range(0, len(states), self.capacity):
+            count = min(self.capacity, len(states) - start)
+            slot_states[:count] = states[start:start + count]
+            slot_masks[:count] = legal_masks[start:start + count]
+            self.requests.put((self.client_id, count, time.monotonic()))
+            self.ready.acquire()
+            policies.append(slot_policies[:count].copy())
+            values.append(slot_values[:count].copy())
+        return np.concatenate(policies), np.concatenate(values)
+
+
+class InferenceServer:
+    """
+    Evaluates the states of every self-play worker with the single model of the training process.
+    A thread collects the requests of the clients until max_batch_size states or timeout seconds after the first one,
+    evaluates them in one forward pass and writes the results back to the shared memory slot of each client.
+    Training the model under lock makes the workers use the new weights from their next request.
+    """
+
+    def __init__(self, model, num_clients, capacity, max_batch_size, timeout):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.requests = multiprocessing.Queue()
+        shapes = [(num_clients, capacity, 3, model.n, model.m),
+                  (num_clients, capacity, model.game.getActionSize()),
+                  (num_clients, capacity, model.game.getActionSize()),
+                  (num_clients, capacity)]
+        self.buffers = [shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 4) for shape in shapes]
+        self.clients = [InferenceClient(client_id, capacity, self.requests, multiprocessing.Semaphore(0),
+                                        self.buffers, shapes) for client_id in range(num_clients)]
+        self.thread = None
+
+        # Statistics of the served requests
+        self.num_requests = 0
+        self.num_batches = 0
+        self.num_states = 0
+        self.queue_depths = deque(maxlen=10000)
+        self.latencies = deque(maxlen=10000)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.requests.put(None)
+            self.thread.join()
+            self.thread = None
+        for buffer in self.buffers:
+            buffer.close()
+            buffer.unlink()
+        self.buffers = []
+
+    def collect(self):
+        """
+        Returns: the requests of the next batch, None when the server is stopped
+        """
+        batch = [self.requests.get()]
+        if batch[0] is None:
+            return None
+        size = batch[0][1]
+        deadline = time.monotonic() + self.timeout
+        while size < self.max_batch_size:
+            try:
+                request = self.requests.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if request is None:
+                # Serve what was collected, then stop
+                self.requests.put(None)
+                break
+            batch.append(request)
+            size += request[1]
+        return batch
+
+    def serve(self):
+        while True:
+            batch = self.collect()
+            if batch is None:
+                return
+            self.queue_depths.append(self.requests.qsize())
+            slots = [self.clients[client_id].slot() for client_id, _, _ in batch]
+            states = np.concatenate([slot[0][:count] for slot, (_, count, _) in zip(slots, batch)])
+            legal_masks = np.concatenate([slot[1][:count] for slot, (_, count, _) in zip(slots, batch)])
+            with self.lock:
+                policies, values = self.model.predict(states, legal_masks)
+
+            start = 0
+            for (_, _, slot_policies, slot_values), (client_id, count, sent) in zip(slots, batch):
+                slot_policies[:count] = policies[start:start + count]
+                slot_values[:count] = values[start:start + count]
+                start += count
+                self.clients[client_id].ready.release()
+                self.latencies.append(time.monotonic() - sent)
+            self.num_requests += len(batch)
+            self.num_batches += 1
+            self.num_states += len(states)
+
+    def stats(self):
+        """
+        Returns: the number of requests and batches served, the mean batch size (in states), the mean queue depth
+        left after collecting a batch, and the 50th, 90th and 99th percentiles of the latency of a request in ms
+        """
+        latencies = np.array(self.latencies) * 1e3 if len(self.latencies) > 0 else np.zeros(1)
+        return {
+            'requests': self.num_requests,
+            'batches': self.num_batches,
+            'batch_size': self.num_states / max(self.num_batches, 1),
+            'queue_depth': float(np.mean(self.queue_depths)) if len(self.queue_depths) > 0 else 0.0,
+            'latency_p50': float(np.percentile(latencies, 50)),
+            'latency_p90': float(np.percentile(latencies, 90)),
+            'latency_p99': float(np.percentile(latencies, 99)),
+        }
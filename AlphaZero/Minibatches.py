@@ -0,0 +1,78 @@
+import threading
+import queue
+import torch
+
+
+class Prefetcher:
+    """
+    Iterates over the batches of an iterable, produced by a background thread up to depth batches ahead of
+    the training step consuming them (synchronously with a depth of 0). The tensors of each batch are pinned
+    when pin_memory is set, so their copy to the GPU can overlap the training step.
+    """
+
+    def __init__(self, batches, depth=2, pin_memory=False):
+        self.batches = batches
+        self.depth = depth
+        self.pin_memory = pin_memory
+
+    def prepare(self, batch):
+        if not self.pin_memory:
+            return batch
+        return tuple(item.pin_memory() if isinstance(item, torch.Tensor) else item for item in batch)
+
+    def __iter__(self):
+        if self.depth == 0:
+            for batch in self.batches:
+                yield self.prepare(batch)
+            return
+
+        batches = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for batch in self.batches:
+                    batch = self.prepare(batch)
+                    # Gives up when the consumer stopped early
+                    while not stop.is_set():
+                        try:
+                            batches.put((batch, None), timeout=0.1)
+                            break
+                        except queue.Full:
+                            pass
+                    if stop.is_set():
+                        return
+                batches.put((None, None))
+            except Exception as error:
+                batches.put((None, error))
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch, error = batches.get()
+                if error is not None:
+                    raise error
+                if batch is None:
+                    return
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
+
+
+def minibatches(tensors, batch_size, epochs=1, steps=0):
+    """
+    Yields minibatches gathered by index from tensors of samples (along their first dimension), in a new random
+    order every epoch, for epochs epochs or only the first steps minibatches when steps is set.
+    """
+    size = len(tensors[0])
+    step = 0
+    for _ in range(epochs):
+        order = torch.randperm(size)
+        for start in range(0, size, batch_size):
+            if 0 < steps <= step:
+                return
+            indices = order[start:start + batch_size]
+            yield tuple(tensor.index_select(0, indices) for tensor in tensors)
+            step += 1
@@ -1,11 +1,14 @@
+from .TranspositionTable import TranspositionTable
+from .ArrayTree import ArrayTree
 import numpy as np
 import torch
 import math
 
 
 class Node:
-    def __init__(self, game, args, parent=None, action_taken=None, prior=0, visit_count=0):
-        self.game = game
+    def __init__(self, key, args, parent=None, action_taken=None, prior=0, visit_count=0):
+        # Hash of the state of the node, children only get it when the search first reaches them
+        self.key = key
         self.args = args
         self.parent = parent
         self.action_taken = action_taken
@@ -37,20 +40,138 @@ class Node:
         return q_value + self.args['UCB_exploration_weight'] * (math.sqrt(self.visit_count) / (child.visit_count + 1)) * child.prior
 
     def expand(self, policy):
-        for action, prob in enumerate(policy):
-            if prob > 0:
-                child_game = self.game.clone()
-                child_game.apply_action(action)
+        for action in np.flatnonzero(policy > 0).tolist():
+            child = Node(None, self.args, parent=self, action_taken=action, prior=policy[action])
+            self.children.append(child)
+
+
+class ObjectTree:
+    """
+    Search tree made of linked Node objects, one per state.
+    Exposes the same interface as ArrayTree, with the Node objects themselves as node handles.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.size = 0
+        self.table = TranspositionTable(args['transposition_table_size']) if args['transposition_table_size'] > 0 else None
+
+    def new_root(self, key):
+        self.size = 1
+        if self.table is not None:
+            self.table.clear()
+        return Node(key, self.args, visit_count=1)
+
+    @staticmethod
+    def get_action(node):
+        return node.action_taken
+
+    @staticmethod
+    def get_key(node):
+        return node.key
+
+    @staticmethod
+    def set_key(node, key):
+        node.key = key
+
+    @staticmethod
+    def get_children(node):
+        return node.children
+
+    @staticmethod
+    def get_child(node, action):
+        for child in node.children:
+            if child.action_taken == action:
+                return child
+        return None
+
+    def reroot(self, node):
+        # Detaching the node from its parent releases the rest of the old tree
+        node.parent = None
+        if self.table is not None:
+            self.table.clear()
+        self.size = 0
+        visited = {id(node)}
+        stack = [node]
+        while stack:
+            parent = stack.pop()
+            self.size += 1
+            if parent.is_expanded() and self.table is not None:
+                self.table.put(parent.key, parent)
+            for child in parent.children:
+                # Children shared by a transposition may still point to a parent of the released tree
+                child.parent = parent
+                if id(child) not in visited:
+                    visited.add(id(child))
+                    stack.append(child)
+        return node
+
+    @staticmethod
+    def is_expanded(node):
+        return node.is_expanded()
+
+    @staticmethod
+    def select(node):
+        return node.select()
+
+    def expand(self, node, policy):
+        node.expand(policy)
+        self.size += len(node.children)
+        if self.table is not None:
+            self.table.put(node.key, node)
 
-                child = Node(child_game, self.args, parent=self, action_taken=action, prior=prob)
-                self.children.append(child)
+    def transpose(self, node):
+        """
+        Shares the children of an expanded node of the same position, found in the transposition table.
 
-    def backpropagate(self, value):
-        self.value_sum += value
-        self.visit_count += 1
+        Returns: the value of that position, or None when the table has no expanded node for it
+        """
+        if self.table is None:
+            return None
+        entry = self.table.get(node.key)
+        if entry is None or not entry.is_expanded():
+            return None
+        node.children = entry.children
+        return entry.value_sum / entry.visit_count
 
-        if self.parent is not None:
-            self.parent.backpropagate(-value)
+    @staticmethod
+    def backpropagate(path, value):
+        for node in reversed(path):
+            node.value_sum += value
+            node.visit_count += 1
+            value = -value
+
+    @staticmethod
+    def add_dirichlet_noise(node, epsilon, alpha):
+        noise = np.random.dirichlet([alpha] * len(node.children))
+        for child, child_noise in zip(node.children, noise):
+            child.prior = (1 - epsilon) * child.prior + epsilon * child_noise
+
+    @staticmethod
+    def add_virtual_loss(path, virtual_loss):
+        """
+        Makes the path to a leaf look visited and lost for the player choosing it,
+        so the next selections of the same batch are steered towards other leaves.
+        """
+        for node in path:
+            node.visit_count += virtual_loss
+            node.value_sum += virtual_loss
+
+    def revert_virtual_loss(self, path, virtual_loss):
+        self.add_virtual_loss(path, -virtual_loss)
+
+    @staticmethod
+    def get_action_visits(node, action_size):
+        action_visits = np.zeros(action_size)
+        for child in node.children:
+            action_visits[child.action_taken] = child.visit_count
+        return action_visits
+
+
+trees = {
+    'object': ObjectTree,
+    'array': ArrayTree,
+}
 
 
 class MCTS:
@@ -58,34 +179,131 @@ class MCTS:
         self.model = model
         self.game = game
         self.args = args
+        self.tree = trees[self.args['mcts_tree']](self.args)
+        self.root = None
+        # Number of positions evaluated by the model
+        self.evaluations = 0
+        # The leaves of a batch are encoded straight into these, row by row
+        batch_size = max(self.args['mcts_batch_size'], 1)
+        self.states = np.zeros((batch_size, 3, game.n, game.m), dtype=np.float32)
+        self.legal_actions = np.zeros((batch_size, game.getActionSize()), dtype=np.float32)
+
+    def advance(self, action):
+        """
+        Keeps the subtree of the action applied to the game, so its statistics are reused by the next search.
+        """
+        child = None if self.root is None else self.tree.get_child(self.root, action)
+        self.root = None if child is None else self.tree.reroot(child)
+
+    def sync(self):
+        """
+        Moves the root to the node of the current game state when the tree already reached it,
+        which covers moves applied to the game without calling advance (at most two plies deep).
+        """
+        frontier = [self.root]
+        key = self.game.hash()
+        for depth in range(3):
+            for node in frontier:
+                if self.tree.get_key(node) == key:
+                    self.root = node if depth == 0 else self.tree.reroot(node)
+                    return
+            frontier = [child for node in frontier for child in self.tree.get_children(node)]
+        self.root = None
 
     @torch.no_grad()
     def search(self):
-        root = Node(self.game, self.args, visit_count=1)
-        policy, _ = self.model(torch.tensor(self.game.get_encoded_board(), device=self.model.device).unsqueeze(0))
-        policy = torch.softmax(policy, dim=1).squeeze(0).cpu().numpy()
-        policy = (1 - self.args['dirichlet_epsilon']) * policy + self.args['dirichlet_epsilon'] * np.random.dirichlet([self.args['dirichlet_alpha']] * self.game.getActionSize())
-        valid_moves = self.game.get_encoded_actions()
-        policy *= valid_moves
-        policy /= np.sum(policy)
-        root.expand(policy)
-        for search in range(self.args['num_mcts_sims']):
-            node = root
-            while node.is_expanded():
-                node = node.select()
-            is_terminal = node.game.game_over
-            value = node.game.winner
-            if not is_terminal:
-                policy, value = self.model(torch.tensor(node.game.get_encoded_board(), device=self.model.device).unsqueeze(0))
-                policy = torch.softmax(policy, dim=1).squeeze(0).cpu().numpy()
-                valid_moves = node.game.get_encoded_actions()
-                policy *= valid_moves
-                policy /= np.sum(policy)
-                value = value.item()
-                node.expand(policy)
-            node.backpropagate(value)
-        action_probs = np.zeros(self.game.getActionSize())
-        for child in root.children:
-            action_probs[child.action_taken] = child.visit_count
+        steps = self.search_steps()
+        try:
+            request = next(steps)
+            while True:
+                request = steps.send(self.model.predict(*request))
+        except StopIteration as stop:
+            return stop.value
+
+    def search_steps(self):
+        """
+        Runs a search as a generator that yields each batch of encoded states to evaluate, with the masks of their
+        legal actions, and is sent back the predictions of the model for them (log-probabilities of the actions
+        and values), so the evaluations of several searches can be batched together.
+
+        Returns: the probabilities of the actions from the root (as the value of StopIteration)
+        """
+        tree = self.tree
+        if not self.args['mcts_reuse_tree']:
+            self.root = None
+        elif self.root is not None:
+            self.sync()
+        if self.root is not None and tree.is_expanded(self.root):
+            tree.add_dirichlet_noise(self.root, self.args['dirichlet_epsilon'], self.args['dirichlet_alpha'])
+        else:
+            self.root = tree.new_root(self.game.hash())
+            self.evaluations += 1
+            log_policy, _ = yield (self.game.get_encoded_board(out=self.states[0])[np.newaxis],
+                                   self.game.get_encoded_actions(out=self.legal_actions[0])[np.newaxis])
+            policy = (1 - self.args['dirichlet_epsilon']) * np.exp(log_policy[0]) + self.args['dirichlet_epsilon'] * np.random.dirichlet([self.args['dirichlet_alpha']] * self.game.getActionSize())
+            # The noise is restricted to the legal actions too
+            policy *= self.legal_actions[0]
+            policy /= np.sum(policy)
+            tree.expand(self.root, policy)
+        root = self.root
+        # The search walks a single copy of the game down to each leaf with push and back with pop,
+        # the game given to MCTS keeps being played outside of it
+        game = self.game.clone()
+
+        # With a batch size of K, K leaves are selected (kept apart by virtual loss) and evaluated together
+        batch_size = self.args['mcts_batch_size']
+        virtual_loss = self.args['virtual_loss'] if batch_size > 1 else 0
+        search = 0
+        while search < self.args['num_mcts_sims']:
+            leaves = []
+            paths = []
+            while len(leaves) < batch_size and search < self.args['num_mcts_sims']:
+                node = root
+                path = [root]
+                cycle = False
+                while tree.is_expanded(node):
+                    node = tree.select(node)
+                    if node in path:
+                        # Children shared between transpositions led back to a position of this path
+                        cycle = True
+                        break
+                    path.append(node)
+                    game.push(tree.get_action(node))
+                    tree.set_key(node, game.hash())
+                    if game.game_over:
+                        # Reached through a transposition of a position that doesn't end the game here
+                        break
+                if node in leaves:
+                    # Every remaining path leads to a leaf already waiting for evaluation
+                    for _ in path[1:]:
+                        game.pop()
+                    break
+                search += 1
+                if cycle:
+                    tree.backpropagate(path, 0)
+                else:
+                    value = game.winner if game.game_over else tree.transpose(node)
+                    if value is not None:
+                        tree.backpropagate(path, value)
+                    else:
+                        tree.add_virtual_loss(path, virtual_loss)
+                        game.get_encoded_board(out=self.states[len(leaves)])
+                        game.get_encoded_actions(out=self.legal_actions[len(leaves)])
+                        leaves.append(node)
+                        paths.append(path)
+                for _ in path[1:]:
+                    game.pop()
+
+            if len(leaves) == 0:
+                continue
+            self.evaluations += len(leaves)
+            log_policies, values = yield self.states[:len(leaves)], self.legal_actions[:len(leaves)]
+            policies = np.exp(log_policies)
+            for leaf, path, policy, value in zip(leaves, paths, policies, values):
+                tree.revert_virtual_loss(path, virtual_loss)
+                tree.expand(leaf, policy)
+                tree.backpropagate(path, value.item())
+
+        action_probs = tree.get_action_visits(root, self.game.getActionSize())
         action_probs /= np.sum(action_probs)
         return action_probs
@@ -7,19 +7,28 @@ class AlphaZeroPlayer:
     def __init__(self, model):
         self.name = "AlphaZeroPlayer"
         self.model = model
+        self.mcts = None
 
     def get_action(self, game):
-        # Create an instance of the MCTS class
-        mcts = MCTS(game, self.model, self.model.args)
+        # Keep the search tree between moves of the same game, a new game gets a new MCTS
+        if self.mcts is None or self.mcts.game is not game:
+            self.mcts = MCTS(game, self.model, self.model.args)
 
         # Get the probabilities of all possible actions
-        action_probs = mcts.search()
+        action_probs = self.mcts.search()
 
         # Select the action with the highest probability
         best_move = np.argmax(action_probs)
 
         return best_move
 
+    def advance(self, action):
+        """
+        Reports an action applied to the game (by either player), so the matching subtree becomes the new root.
+        """
+        if self.mcts is not None:
+            self.mcts.advance(action)
+
 
 class RandomPlayer:
     def __init__(self):
@@ -58,12 +67,13 @@ class GreedyPlayer:
         best_reward = float('-inf')
 
         for move in legal_moves:
-            game_copy = game.clone()  # Ensure the original game state is not modified
+            # The move is taken back after looking at its reward, so the game is left as it was
             if game.name == "G":
-                game_copy.apply_action(game_copy.encode(move))
+                game.push(game.encode(move))
             else:
-                game_copy.apply_action(game_copy.encode(move[0], move[1]))
-            reward = game_copy.get_score()
+                game.push(game.encode(move[0], move[1]))
+            reward = game.get_score()
+            game.pop()
 
             if reward > best_reward:
                 best_reward = reward
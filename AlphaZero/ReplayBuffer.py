@@ -0,0 +1,144 @@
+import numpy as np
+import torch
+import os
+
+
+class ReplayBuffer:
+    """
+    Fixed-capacity ring of training positions, in preallocated arrays: encoded states (uint8), policies,
+    outcomes (int8) and the version of the model that played each position.
+    Policies are stored sparsely, as the action indices (uint16) and probabilities (float16) of their policy_width
+    largest entries, which hold every visited child unless the search visited more of them.
+    With a directory the arrays are memory-mapped .npy files in it, so a resumed training starts with the buffer
+    it left off with, or with an empty one when the capacity or the policy width of the buffer changed.
+    """
+
+    def __init__(self, game, capacity, policy_width, directory=None):
+        self.capacity = capacity
+        self.action_size = game.getActionSize()
+        self.policy_width = min(policy_width, self.action_size)
+        shapes = {
+            'states': ((capacity, 3, game.n, game.m), np.uint8),
+            'policy_indices': ((capacity, self.policy_width), np.uint16),
+            'policy_values': ((capacity, self.policy_width), np.float16),
+            'outcomes': ((capacity,), np.int8),
+            'versions': ((capacity,), np.int64),
+            # Next slot to write and number of positions held
+            'position': ((2,), np.int64),
+        }
+        if directory is None:
+            arrays = {name: np.zeros(shape, dtype=dtype) for name, (shape, dtype) in shapes.items()}
+        else:
+            arrays = self.open_shards(directory, shapes)
+        self.states = arrays['states']
+        self.policy_indices = arrays['policy_indices']
+        self.policy_values = arrays['policy_values']
+        self.outcomes = arrays['outcomes']
+        self.versions = arrays['versions']
+        self.position = arrays['position']
+
+    @staticmethod
+    def open_shards(directory, shapes):
+        """
+        Returns: the arrays memory-mapped to the shards of directory, all of them created empty (an empty buffer)
+                 unless every shard is already there with its shape and dtype, since a position is spread over them
+        """
+        paths = {name: f"{directory}replay_{name}.npy" for name in shapes}
+        shards = {}
+        for name, (shape, dtype) in shapes.items():
+            if not os.path.exists(paths[name]):
+                break
+            shard = np.load(paths[name], mmap_mode='r+')
+            if shard.shape != shape or shard.dtype != dtype:
+                break
+            shards[name] = shard
+        else:
+            return shards
+        # Mismatched shards are released before they are recreated
+        shard = None
+        shards.clear()
+        os.makedirs(os.path.dirname(paths['position']) or '.', exist_ok=True)
+        return {name: np.lib.format.open_memmap(paths[name], mode='w+', dtype=dtype, shape=shape)
+                for name, (shape, dtype) in shapes.items()}
+
+    def __len__(self):
+        return int(self.position[1])
+
+    @property
+    def nbytes(self):
+        return (self.states.nbytes + self.policy_indices.nbytes + self.policy_values.nbytes + self.outcomes.nbytes
+                + self.versions.nbytes)
+
+    def sparsify(self, policies):
+        """
+        Returns: the indices and values of the policy_width largest entries of each dense policy,
+                 renormalised when other non-zero entries had to be dropped
+        """
+        if self.policy_width < self.action_size:
+            indices = np.argpartition(-policies, self.policy_width - 1, axis=1)[:, :self.policy_width]
+        else:
+            indices = np.broadcast_to(np.arange(self.action_size), policies.shape)
+        values = np.take_along_axis(policies, indices, axis=1)
+        values = values / np.sum(values, axis=1, keepdims=True)
+        return indices, values
+
+    def densify(self, indices, values):
+        """
+        Returns: the dense policies of sparse ones
+        """
+        policies = np.zeros((len(indices), self.action_size), dtype=np.float32)
+        np.add.at(policies, (np.arange(len(indices))[:, np.newaxis], indices), values)
+        return policies
+
+    def add(self, states, policies, outcomes, version=0):
+        """
+        Appends positions, overwriting the oldest ones once the buffer is full.
+        """
+        count = min(len(states), self.capacity)
+        # Only the last capacity positions would survive
+        states, policies, outcomes = states[-count:], policies[-count:], outcomes[-count:]
+        index = int(self.position[0])
+        slots = (index + np.arange(count)) % self.capacity
+        self.states[slots] = states
+        self.policy_indices[slots], self.policy_values[slots] = self.sparsify(policies)
+        self.outcomes[slots] = outcomes
+        self.versions[slots] = version
+        self.position[0] = (index + count) % self.capacity
+        self.position[1] = min(len(self) + count, self.capacity)
+
+    def add_training_data(self, training_data, version=0):
+        states, policies, outcomes = zip(*training_data)
+        self.add(np.array(states), np.array(policies), np.array(outcomes), version)
+
+    def sample(self, batch_size, half_life=0):
+        """
+        Samples batch_size positions uniformly or, with a half_life, with weights halving every half_life positions
+        back from the newest one.
+
+        Returns: the states (float32), sparse policies (indices and values), outcomes and versions of the positions
+        """
+        size = len(self)
+        if half_life > 0:
+            # Inverse of the CDF of the ages, an exponential distribution truncated to the size of the buffer
+            rate = np.log(2) / half_life
+            u = np.random.random(batch_size)
+            ages = np.minimum((-np.log1p(-u * -np.expm1(-rate * size)) / rate).astype(np.int64), size - 1)
+            indices = (int(self.position[0]) - 1 - ages) % self.capacity
+        else:
+            indices = np.random.randint(size, size=batch_size)
+        return (self.states[indices].astype(np.float32), (self.policy_indices[indices], self.policy_values[indices]),
+                self.outcomes[indices], self.versions[indices])
+
+    def batches(self, batch_size, num_samples, half_life=0):
+        """
+        Yields: batches of num_samples positions in total, sampled like sample, with the states and outcomes as tensors
+        """
+        for start in range(0, num_samples, batch_size):
+            states, (policy_indices, policy_values), outcomes, versions = self.sample(
+                min(batch_size, num_samples - start), half_life)
+            yield torch.from_numpy(states), policy_indices, policy_values, torch.from_numpy(outcomes), versions
+
+    def flush(self):
+        for array in [self.states, self.policy_indices, self.policy_values, self.outcomes, self.versions, self.position]:
+            if isinstance(array, np.memmap):
+                array.flush()
@@ -0,0 +1,223 @@
+from .SelfPlay import SelfPlayWorkers, connect_worker, server_self_play
+from .InferenceServer import InferenceServer
+from .CNNET import CNNET
+from multiprocessing import Pool
+import multiprocessing
+import queue
+import time
+import os
+import torch
+
+# Memory of a process once torch is imported, before any model
+PROCESS_MEMORY = 300 * 2 ** 20
+
+
+def read_file(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def available_cpus():
+    """
+    Returns: the CPUs this process may run on
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(multiprocessing.cpu_count()))
+
+
+def cpu_quota():
+    """
+    Returns: the number of CPUs the CPU quota of the cgroup (v2 or v1) allows, None when there is none
+    """
+    cpu_max = read_file('/sys/fs/cgroup/cpu.max')
+    if cpu_max is not None:
+        quota, period = cpu_max.split()
+        return None if quota == 'max' else int(quota) / int(period)
+    quota = read_file('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+    period = read_file('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if quota is None or period is None or int(quota) <= 0:
+        return None
+    return int(quota) / int(period)
+
+
+def memory_limit():
+    """
+    Returns: the bytes of memory available, the memory limit of the cgroup when it is below the physical memory
+    """
+    memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    for path in ['/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes']:
+        limit = read_file(path)
+        if limit is not None and limit != 'max':
+            memory = min(memory, int(limit))
+    return memory
+
+
+def detect_resources():
+    """
+    Returns: the CPUs of the process, the CPU quota, the number of cores it can keep busy (the CPUs,
+             bounded by the quota), the bytes of memory available and whether there is a GPU
+    """
+    cpus = available_cpus()
+    quota = cpu_quota()
+    return {
+        'cpus': cpus,
+        'cpu_quota': quota,
+        'cores': len(cpus) if quota is None else max(1, min(len(cpus), int(quota))),
+        'memory': memory_limit(),
+        'gpu': torch.cuda.is_available(),
+    }
+
+
+def concurrent_mode(args):
+    """
+    Returns: whether the training mode of args keeps its self-play workers playing at the same time
+    """
+    return args['inference_server'] or args['self_play_workers'] or args['async_training']
+
+
+def model_bytes(game, args):
+    with torch.device('meta'):
+        model = CNNET(game, args, training=False)
+    return 4 * sum(parameter.numel() for parameter in model.parameters())
+
+
+def schedule(game, args, resources, num_workers=None):
+    """
+    Chooses the number of self-play workers (num_workers when given), the torch threads of each worker and of the
+    trainer and the batch size of the inference server so they fit resources:
+        - when the workers play while the model trains or evaluates (inference server, persistent workers or
+          asynchronous training), the cores split between the workers (one per worker by default), but for a core
+          left to the trainer on the CPU
+        - otherwise (one episode at a time) a single worker with the threads of every core
+        - no more workers than the memory holds, with a copy of the model and its evaluation cache each
+        - a server batch holding a request of every worker
+
+    Returns: the args to update
+    """
+    cores = resources['cores']
+    concurrent = concurrent_mode(args)
+    worker_cores = cores if resources['gpu'] or not concurrent else max(1, cores - 1)
+    if num_workers is None:
+        num_workers = worker_cores if concurrent else 1
+
+    size = model_bytes(game, args)
+    worker_memory = PROCESS_MEMORY + (0 if args['inference_server'] else 2 * size + args['evaluation_cache_mb'] * 2 ** 20)
+    policy_width = min(args['replay_policy_width'], game.getActionSize())
+    replay_memory = args['replay_buffer_size'] * (3 * game.n * game.m + 4 * policy_width + 9)
+    # Weights, gradients and the two moments of Adam
+    trainer_memory = PROCESS_MEMORY + 4 * size + replay_memory
+    num_workers = max(1, min(num_workers, int((0.8 * resources['memory'] - trainer_memory) // worker_memory)))
+
+    worker_threads = max(1, worker_cores // num_workers)
+    if not concurrent or resources['gpu']:
+        trainer_threads = cores
+    else:
+        trainer_threads = max(1, cores - num_workers * worker_threads)
+    return {
+        'num_processes': num_workers,
+        'worker_threads': worker_threads,
+        'trainer_threads': trainer_threads,
+        'inference_batch_size': num_workers * max(args['mcts_batch_size'], 1),
+    }
+
+
+def worker_cpu_sets(args):
+    """
+    Returns: a queue of the CPU sets the workers pin themselves to, args['worker_threads'] CPUs each,
+             None unless args['pin_workers'] is set
+    """
+    if not args['pin_workers']:
+        return None
+    cpus = available_cpus()
+    threads = min(args['worker_threads'] or 1, len(cpus))
+    cpu_sets = multiprocessing.Queue()
+    for worker in range(args['num_processes']):
+        start = worker * threads % len(cpus)
+        cpu_sets.put(set((cpus + cpus)[start:start + threads]))
+    return cpu_sets
+
+
+def positions_per_second(next_episodes, seconds):
+    """
+    Plays the episodes next_episodes returns (at least one, blocking) for about seconds (until an episode ends at
+    least), counted from the end of the first ones so the startup of the processes is left out.
+
+    Returns: the positions per second of the episodes
+    """
+    next_episodes()
+    start = time.perf_counter()
+    positions = 0
+    while time.perf_counter() - start < seconds or positions == 0:
+        for training_data in next_episodes():
+            positions += len(training_data)
+    return positions / (time.perf_counter() - start)
+
+
+def calibrate(game, args, seconds):
+    """
+    Plays self-play games for about seconds with the workers of the training mode of args: workers evaluating on
+    an inference server, or persistent workers, which asynchronous training runs too. The training steps between
+    the episodes are left out, the trainer has threads of its own.
+
+    Returns: the positions per second the workers played
+    """
+    model = CNNET(game, args, training=False).to(args['device'])
+    cpu_sets = worker_cpu_sets(args)
+    if not args['inference_server']:
+        workers = SelfPlayWorkers(game, args, model, args['num_processes'], cpu_sets)
+        try:
+            return positions_per_second(lambda: [data for data, _ in workers.poll(block=True)], seconds)
+        finally:
+            workers.stop()
+
+    server = InferenceServer(model, args['num_processes'], args['mcts_batch_size'], args['inference_batch_size'],
+                             args['inference_timeout'])
+    free_clients = multiprocessing.Queue()
+    for client_id in range(args['num_processes']):
+        free_clients.put(client_id)
+    server.start()
+    pool = Pool(args['num_processes'], initializer=connect_worker,
+                initargs=(server.clients, free_clients, game, args, cpu_sets))
+    episodes = queue.Queue()
+
+    def next_episodes():
+        # Every worker keeps playing an episode
+        training_data = episodes.get()
+        pool.apply_async(server_self_play, (None,), callback=episodes.put)
+        return [training_data]
+
+    try:
+        for _ in range(args['num_processes']):
+            pool.apply_async(server_self_play, (None,), callback=episodes.put)
+        return positions_per_second(next_episodes, seconds)
+    finally:
+        pool.terminate()
+        server.stop()
+
+
+def autotune(game, args, resources, seconds):
+    """
+    Calibrates the configuration of schedule for 1, 2, 4... workers up to the number of cores they get, sharing
+    these between them, and picks the one playing the most positions per second.
+    Only the concurrent training modes are calibrated, the others play one episode at a time whatever the number
+    of workers, so they keep the configuration of schedule.
+
+    Returns: the args to update
+    """
+    if not concurrent_mode(args):
+        return schedule(game, args, resources)
+    max_workers = schedule(game, args, resources)['num_processes']
+    candidates = sorted({min(2 ** i, max_workers) for i in range(max_workers.bit_length() + 1)})
+    best = None
+    for num_workers in candidates:
+        configuration = schedule(game, args, resources, num_workers)
+        rate = calibrate(game, dict(args, **configuration), seconds)
+        print(f"{configuration['num_processes']} workers of {configuration['worker_threads']} threads: "
+              f"{rate:.1f} positions/sec")
+        if best is None or rate > best[0]:
+            best = (rate, configuration)
+    return best[1]
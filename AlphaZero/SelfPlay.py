@@ -0,0 +1,234 @@
+from .MonteCarlo import MCTS
+from .CNNET import CNNET
+import multiprocessing
+import queue
+import numpy as np
+import torch
+import os
+
+# Inference server client, game and args of a self-play worker process
+worker = {}
+
+
+def configure_worker(args, cpu_sets=None):
+    """
+    Sets up a self-play worker process: its torch threads (args['worker_threads']) and, with a queue of CPU sets,
+    the CPUs it runs on.
+    """
+    if args['worker_threads'] is not None:
+        torch.set_num_threads(args['worker_threads'])
+    if cpu_sets is not None:
+        os.sched_setaffinity(0, cpu_sets.get())
+
+
+def connect_worker(clients, free_clients, game, args, cpu_sets=None):
+    """
+    Pool initializer of the self-play workers of an inference server: takes a free client slot.
+    """
+    configure_worker(args, cpu_sets)
+    worker['client'] = clients[free_clients.get()]
+    worker['game'] = game
+    worker['args'] = args
+
+
+def server_self_play(_):
+    return self_play_episode(worker['game'], worker['args'], worker['client'])
+
+
+class SelfPlayEpisode:
+    """
+    A self-play game in progress, whose searches run step by step so the evaluations of several games
+    can be batched together.
+    """
+
+    def __init__(self, game, args, model):
+        self.initial_game = game
+        # Create a copy of the game to play out the self-play episode
+        self.game = game.clone()
+        # Create a new MCTS instance for self-play
+        self.mcts = MCTS(self.game, model, args)
+        self.args = args
+        self.steps = None
+        self.history = []
+
+    def step(self, evaluation=None):
+        """
+        Plays the game until its search needs states evaluated, sending it the predictions for the states it asked for last.
+
+        Returns: the encoded states to evaluate and the masks of their legal actions, None when the game is over
+        """
+        while not self.game.is_terminal():
+            try:
+                if self.steps is None:
+                    self.steps = self.mcts.search_steps()
+                    return next(self.steps)
+                return self.steps.send(evaluation)
+            except StopIteration as stop:
+                self.steps = None
+                self.play(stop.value)
+        return None
+
+    def play(self, action_prob):
+        self.history.append((self.game.get_encoded_board(), action_prob, self.game.player_turn))
+
+        # Apply the selected action to the state
+        action = np.random.choice(self.game.getActionSize(), p=action_prob)
+        self.game.apply_action(action)
+        self.mcts.advance(action)
+
+    def training_data(self):
+        """
+        Returns: the (encoded state, action probabilities, outcome) samples of the finished game,
+                 with every symmetric variant of each position when args['augment_symmetries'] is set
+        """
+        if len(self.history) == 0:
+            return []
+        states, action_probs, players = zip(*self.history)
+        outcomes = [self.game.winner if player == self.initial_game.player_turn else -self.game.winner
+                    for player in players]
+        states = np.stack(states).reshape(len(states), 3, -1)
+        action_probs = np.stack(action_probs)
+        if not self.args['augment_symmetries']:
+            return list(zip(states.reshape(len(states), 3, self.game.n, self.game.m), action_probs, outcomes))
+
+        # The board and action permutations of each symmetry are precomputed for the game and its size
+        training_data = []
+        for board_index, action_index in self.initial_game.get_symmetries():
+            augmented_states = states[:, :, board_index].reshape(len(states), 3, self.game.n, self.game.m)
+            training_data.extend(zip(augmented_states, action_probs[:, action_index], outcomes))
+        return training_data
+
+
+@torch.no_grad()
+def self_play_episode(game, args, model):
+    """
+    Plays a self-play episode of game, evaluating the states with model (a CNNET or an inference server client).
+
+    Returns: the training data of the episode
+    """
+    episode = SelfPlayEpisode(game, args, model)
+    request = episode.step()
+    while request is not None:
+        request = episode.step(model.predict(*request))
+    return episode.training_data()
+
+
+@torch.no_grad()
+def self_play_stream(game, args, model, num_games):
+    """
+    Plays self-play episodes of game, num_games at once, evaluating the states all their searches ask for
+    in a single call to model.
+
+    Yields: the training data of every finished episode, replaced by a new one
+    """
+    episodes = [SelfPlayEpisode(game, args, model) for _ in range(num_games)]
+    requests = [episode.step() for episode in episodes]
+    while True:
+        for i in range(num_games):
+            while requests[i] is None:
+                yield episodes[i].training_data()
+                episodes[i] = SelfPlayEpisode(game, args, model)
+                requests[i] = episodes[i].step()
+
+        states, legal_masks = zip(*requests)
+        log_policies, values = model.predict(np.concatenate(states), np.concatenate(legal_masks))
+        start = 0
+        for i, episode in enumerate(episodes):
+            count = len(states[i])
+            requests[i] = episode.step((log_policies[start:start + count], values[start:start + count]))
+            start += count
+
+
+class SharedWeights:
+    """
+    Weights of a model in a shared memory tensor, with the version of the model they were copied from,
+    so every worker process can copy the latest weights into its own model.
+    """
+
+    def __init__(self, model):
+        self.tensor = torch.zeros(sum(tensor.numel() for tensor in model.state_dict().values())).share_memory_()
+        self.version = multiprocessing.Value('q', -1)
+        self.publish(model)
+
+    def publish(self, model):
+        with self.version.get_lock():
+            start = 0
+            for tensor in model.state_dict().values():
+                self.tensor[start:start + tensor.numel()] = tensor.detach().reshape(-1).cpu()
+                start += tensor.numel()
+            self.version.value = model.version
+
+    def load(self, model):
+        """
+        Copies the weights into model when they are newer than its own.
+        """
+        if self.version.value == model.version:
+            return
+        with self.version.get_lock():
+            start = 0
+            for tensor in model.state_dict().values():
+                tensor.copy_(self.tensor[start:start + tensor.numel()].view_as(tensor))
+                start += tensor.numel()
+            model.version = self.version.value
+
+
+def self_play_worker(game, args, weights, records, cpu_sets=None):
+    """
+    Process of a persistent self-play worker: builds its model once and plays args['self_play_games'] episodes at once,
+    putting the training data of every finished episode in records with the version of the weights that played it.
+    """
+    configure_worker(args, cpu_sets)
+    model = CNNET(game, args, training=False).to(args['device'])
+    # Its own initial weights are not those of any published version
+    model.version = None
+    weights.load(model)
+    for training_data in self_play_stream(game, args, model, args['self_play_games']):
+        records.put((training_data, model.version))
+        # Weights published since are used from the next moves on
+        weights.load(model)
+
+
+class SelfPlayWorkers:
+    """
+    Long-lived self-play worker processes, started once for the whole training.
+    The weights of the model reach them through publish, the games they play come back through get.
+    """
+
+    def __init__(self, game, args, model, num_workers, cpu_sets=None):
+        self.weights = SharedWeights(model)
+        self.records = multiprocessing.Queue()
+        # Kept alive until the workers took their CPU set
+        self.cpu_sets = cpu_sets
+        self.processes = [multiprocessing.Process(target=self_play_worker,
+                                                  args=(game, args, self.weights, self.records, cpu_sets), daemon=True)
+                          for _ in range(num_workers)]
+        for process in self.processes:
+            process.start()
+
+    def publish(self, model):
+        self.weights.publish(model)
+
+    def get(self):
+        """
+        Returns: the training data of the next finished episode and the version of the weights that played it
+        """
+        return self.records.get()
+
+    def poll(self, block):
+        """
+        Returns: the records of every episode finished so far, waiting for one when block is set and there are none
+        """
+        records = [self.records.get()] if block else []
+        while True:
+            try:
+                records.append(self.records.get_nowait())
+            except queue.Empty:
+                return records
+
+    def stop(self):
+        # Workers keep nothing worth waiting for, their unfinished games are dropped
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        self.processes = []
@@ -2,3 +2,4 @@ from .Players import AlphaZeroPlayer, RandomPlayer, GreedyPlayer
 from .AlphaZero import AlphaZero
 from .MonteCarlo import MCTS
 from .CNNET import CNNET
+from .Inference import InferenceModel
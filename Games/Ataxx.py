@@ -1,7 +1,7 @@
 import contextlib
-with contextlib.redirect_stdout(None), contextlib.redirect_stderr(None):
-    import pygame
-from boards import draw_board_ataxx as draw_board
+from .AtaxxActions import action_tables, convert_legacy_actions
+from .Symmetries import ataxx_symmetries
+from .Zobrist import zobrist_keys, board_hash
 import numpy as np
 import copy
 import sys
@@ -13,13 +13,17 @@ class Ataxx:
     Player1 is represented by 1 in the board
     player2 is represented by -1 in the board
     Board is represented by a 2D matrix of size n x m
+    Actions applied with push are taken back with pop, from the squares changed while they were applied
+    Actions are encoded by action_encoding, one of AtaxxActions.action_encodings
     """
 
-    def __init__(self, n, m):
+    def __init__(self, n, m, action_encoding='legacy'):
         self.n = n
         self.m = m
         self.name = 'A'
-        self.model_name = f"{self.name}{n}x{m}"
+        self.action_encoding = action_encoding
+        self.model_name = f"{self.name}{n}x{m}" if action_encoding == 'legacy' else f"{self.name}{n}x{m}-{action_encoding}"
+        self.action_sources, self.action_targets, self.action_table = action_tables(n, m, action_encoding)
         self.player_turn = 1
         self.score = {1: 0, -1: 0}
         self.board = [[0 for _ in range(m)] for _ in range(n)]
@@ -28,16 +32,51 @@ class Ataxx:
         # Put the initial pieces in the corners
         self.board[0][0] = self.board[self.n - 1][self.m - 1] = -1
         self.board[self.n - 1][0] = self.board[0][self.m - 1] = 1
+        # State of the game before each pushed action, and the squares changed since the first one
+        self.history = []
+        self.changes = []
+        # Zobrist hash of the board and side to move, updated on every change of a square or of the turn
+        self.keys, self.side_key = zobrist_keys(n, m)
+        self.zobrist = board_hash(self.board, self.player_turn, n, m)
 
     def clone(self):
-        newGame = Ataxx(self.n, self.m)
+        newGame = Ataxx(self.n, self.m, self.action_encoding)
         newGame.player_turn = copy.deepcopy(self.player_turn)
         newGame.score = copy.deepcopy(self.score)
         newGame.board = copy.deepcopy(self.board)
         newGame.game_over = copy.deepcopy(self.game_over)
         newGame.winner = copy.deepcopy(self.winner)
+        newGame.zobrist = self.zobrist
         return newGame
 
+    def hash(self):
+        return self.zobrist
+
+    def set_cell(self, i, j, color):
+        if self.history:
+            self.changes.append((i, j, self.board[i][j]))
+        if self.board[i][j] != 0:
+            self.zobrist ^= self.keys[self.board[i][j]][i][j]
+        if color != 0:
+            self.zobrist ^= self.keys[color][i][j]
+        self.board[i][j] = color
+
+    def push(self, action):
+        """
+        Applies an action so that pop can take it back, without copying the game.
+        """
+        self.history.append((self.player_turn, self.score, self.game_over, self.winner, self.zobrist, len(self.changes)))
+        self.apply_action(action)
+
+    def pop(self):
+        """
+        Takes back the last action applied by push, restoring the game exactly as it was before it.
+        """
+        self.player_turn, self.score, self.game_over, self.winner, self.zobrist, mark = self.history.pop()
+        while len(self.changes) > mark:
+            i, j, color = self.changes.pop()
+            self.board[i][j] = color
+
     def get_score(self):
         return self.score[-self.player_turn]
 
@@ -59,15 +98,15 @@ class Ataxx:
         walkers = [walker[1] for walker in walkers if piece == walker[0]]
         jumpers = [jumper[1] for jumper in jumpers if piece == jumper[0]]
         if (i, j) in walkers:
-            self.board[i][j] = self.player_turn
+            self.set_cell(i, j, self.player_turn)
             self.transform_surroundings(i, j)
             self.update_score(verbose)
             self.is_terminal()
             self.change_turn()
 
         elif (i, j) in jumpers:
-            self.board[i][j] = self.player_turn
-            self.board[piece[0]][piece[1]] = 0
+            self.set_cell(i, j, self.player_turn)
+            self.set_cell(piece[0], piece[1], 0)
             self.transform_surroundings(i, j)
             self.update_score(verbose)
             self.is_terminal()
@@ -78,7 +117,7 @@ class Ataxx:
             for row in range(self.n):
                 for col in range(self.m):
                     if self.board[row][col] == 0:
-                        self.board[row][col] = color
+                        self.set_cell(row, col, color)
                         self.score[color] += 1
         """
         Check if the game is over (win, loss, or draw)
@@ -118,20 +157,36 @@ class Ataxx:
             print(f"Yellow score: {self.score[-1]}\n")
 
     def encode(self, piece, move):
-        return piece[0] * self.m * self.n * self.m + piece[1] * self.n * self.m + move[0] * self.m + move[1]
+        return int(self.action_table[piece[0] * self.m + piece[1], move[0] * self.m + move[1]])
 
     def decode(self, index):
-        dest_m = index % self.m
-        index //= self.m
-        dest_n = index % self.n
-        index //= self.n
-        src_m = index % self.m
-        index //= self.m
-        src_n = index % self.n
-        return (src_n, src_m), (dest_n, dest_m)
+        source, target = int(self.action_sources[index]), int(self.action_targets[index])
+        if source == -1:
+            # A walk merged by target: any piece next to the target clones the same way
+            source = self.clone_source(target)
+        return divmod(source, self.m), divmod(target, self.m)
+
+    def clone_source(self, target):
+        """
+        Returns: a square of a piece of the player to move next to target, target itself when there is none
+        """
+        i, j = divmod(target, self.m)
+        for di in range(-1, 2):
+            for dj in range(-1, 2):
+                if self.is_valid(i + di, j + dj):
+                    return (i + di) * self.m + j + dj
+        return target
+
+    def convert_legacy_actions(self, values):
+        """
+        Returns: values indexed by legacy action along their first axis (a torch tensor), indexed by the actions
+        of the encoding of this game
+        """
+        return convert_legacy_actions(values, self.n, self.m, self.action_encoding)
 
     def change_turn(self):
         self.player_turn *= -1
+        self.zobrist ^= self.side_key
 
     def getBoardSize(self):
         return self.n, self.m
@@ -141,30 +196,39 @@ class Ataxx:
         Returns:
             actionSize: number of all possible actions
         """
-        return self.n * self.m * self.n * self.m
+        return len(self.action_sources)
+
+    def get_symmetries(self):
+        """
+        Returns: (board_index, action_index) pairs of the board symmetries, where board.flat[board_index]
+        is the transformed board and policy[action_index] its policy
+        """
+        return ataxx_symmetries(self.n, self.m, self.action_encoding)
 
-    def get_encoded_actions(self):
+    def get_encoded_actions(self, out=None):
+        """
+        Returns: the legal actions encoded as 1 and the others as 0, written into out when given
+        """
+        encoded_legal_actions = np.zeros(self.getActionSize(), dtype=np.int64) if out is None else np.asarray(out)
+        if out is not None:
+            encoded_legal_actions.fill(0)
         legal_moves1, legal_moves2 = self.get_legal_actions()
-        encoded_legal_actions = [0] * self.getActionSize()
-
-        for piece, move in legal_moves1:
-            value = self.encode(piece, move)
-            encoded_legal_actions[value] = 1
-        for piece, move in legal_moves2:
-            value = self.encode(piece, move)
-            encoded_legal_actions[value] = 1
+        moves = np.array([(piece[0] * self.m + piece[1], move[0] * self.m + move[1])
+                          for piece, move in legal_moves1 + legal_moves2], dtype=np.int64).reshape(-1, 2)
+        encoded_legal_actions[self.action_table[moves[:, 0], moves[:, 1]]] = 1
         return encoded_legal_actions
 
-    def get_encoded_board(self, state=None):
-        if state is None:
-            state = self.board
-        layer_1 = np.where(np.array(state) == -1, 1, 0).astype(np.float32)
-        layer_2 = np.where(np.array(state) == 0, 1, 0).astype(np.float32)
-        layer_3 = np.where(np.array(state) == 1, 1, 0).astype(np.float32)
-
-        result = np.stack([layer_1, layer_2, layer_3]).astype(np.float32)
-
-        return result
+    def get_encoded_board(self, state=None, out=None):
+        """
+        Returns: the (3, n, m) planes of the opponent's pieces, the empty squares and the player's pieces,
+                 written into out (a NumPy array or CPU tensor, like a row of a batch) when given
+        """
+        board = np.array(self.board if state is None else state, dtype=np.int8)
+        encoded = np.empty((3, self.n, self.m), dtype=np.float32) if out is None else np.asarray(out)
+        encoded[0] = board == -1
+        encoded[1] = board == 0
+        encoded[2] = board == 1
+        return encoded
 
     def is_valid(self, i, j):
         if 0 <= i < self.n and 0 <= j < self.m:
@@ -185,7 +249,7 @@ class Ataxx:
             for m in range(-1, 2):
                 if 0 <= i + n < rows and 0 <= j + m < cols:
                     if self.board[i + n][j + m] == -self.player_turn:
-                        self.board[i + n][j + m] = self.player_turn
+                        self.set_cell(i + n, j + m, self.player_turn)
 
     def jump(self, i, j):
         successors = []
@@ -230,6 +294,10 @@ class Ataxx:
         screen_height = None
         selected_piece = None
         if verbose:
+            # Headless games never import pygame
+            with contextlib.redirect_stdout(None), contextlib.redirect_stderr(None):
+                import pygame
+            from boards import draw_board_ataxx as draw_board
             pygame.init()
             screen_width = self.m * 100  # columns * 100
             screen_height = self.n * 100  # rows * 100
@@ -0,0 +1,87 @@
+from functools import lru_cache
+import numpy as np
+
+# Encodings of the Ataxx actions:
+#   legacy: source square * n * m + target square, every pair of squares of the board
+#   offsets: source square * 24 + index of the target in OFFSETS
+#   clone: the walks (which clone a piece) by target square, then source square * 16 + index of the target in JUMPS
+action_encodings = ['legacy', 'offsets', 'clone']
+
+OFFSETS = [(di, dj) for di in range(-2, 3) for dj in range(-2, 3) if di != 0 or dj != 0]
+JUMPS = [(di, dj) for di, dj in OFFSETS if abs(di) > 1 or abs(dj) > 1]
+
+
+def action_size(n, m, encoding):
+    return {'legacy': n * m * n * m, 'offsets': n * m * len(OFFSETS), 'clone': n * m * (1 + len(JUMPS))}[encoding]
+
+
+@lru_cache(maxsize=None)
+def action_tables(n, m, encoding):
+    """
+    Returns:
+        sources, targets: the source and target square (i * m + j) of each action, the source -1 for walks merged
+                          by target and the target -1 for actions off the board
+        actions: (n * m, n * m) array of the action of each source and target square, -1 when there is none
+    """
+    size = n * m
+    sources = np.full(action_size(n, m, encoding), -1, dtype=np.int64)
+    targets = np.full(action_size(n, m, encoding), -1, dtype=np.int64)
+    actions = np.full((size, size), -1, dtype=np.int64)
+    if encoding == 'legacy':
+        sources[:] = np.repeat(np.arange(size), size)
+        targets[:] = np.tile(np.arange(size), size)
+        actions[:] = np.arange(size * size).reshape(size, size)
+        return sources, targets, actions
+
+    if encoding == 'offsets':
+        start, offsets = 0, OFFSETS
+    else:
+        # The walks come first, one action per target square
+        targets[:size] = np.arange(size)
+        start, offsets = size, JUMPS
+    for source in range(size):
+        i, j = divmod(source, m)
+        for k, (di, dj) in enumerate(offsets):
+            action = start + source * len(offsets) + k
+            sources[action] = source
+            if 0 <= i + di < n and 0 <= j + dj < m:
+                targets[action] = (i + di) * m + j + dj
+                actions[source, targets[action]] = action
+    if encoding == 'clone':
+        for target in range(size):
+            i, j = divmod(target, m)
+            for di, dj in OFFSETS:
+                if (di, dj) not in JUMPS and 0 <= i + di < n and 0 <= j + dj < m:
+                    actions[(i + di) * m + j + dj, target] = target
+    return sources, targets, actions
+
+
+@lru_cache(maxsize=None)
+def legacy_actions(n, m, encoding):
+    """
+    Returns: for each action of the encoding, the legacy actions it stands for (none off the board, every walk
+    to its target for the walks merged by target)
+    """
+    sources, targets, actions = action_tables(n, m, encoding)
+    legacy = []
+    for source, target in zip(sources, targets):
+        if target == -1:
+            legacy.append([])
+        elif source == -1:
+            legacy.append([int(walker) * n * m + int(target) for walker in np.flatnonzero(actions[:, target] == target)])
+        else:
+            legacy.append([int(source) * n * m + int(target)])
+    return legacy
+
+
+def convert_legacy_actions(values, n, m, encoding):
+    """
+    Converts values indexed by legacy action along their first axis, like the rows of the policy layer of a model
+    saved in the legacy encoding, to the actions of encoding: the mean of the values of the legacy actions
+    each action stands for, 0 for the actions off the board.
+    """
+    converted = values.new_zeros((action_size(n, m, encoding),) + tuple(values.shape[1:]))
+    for action, legacy in enumerate(legacy_actions(n, m, encoding)):
+        if len(legacy) > 0:
+            converted[action] = values[legacy].mean(dim=0)
+    return converted
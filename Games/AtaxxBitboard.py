@@ -0,0 +1,248 @@
+from functools import lru_cache
+from .Zobrist import zobrist_keys, board_hash
+from .AtaxxActions import action_tables
+from .Ataxx import Ataxx
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def move_tables(n, m):
+    """
+    Precomputed tables of an n x m board, indexed by square (i * m + j):
+        walk_targets, jump_targets: the squares one and two steps away, as (square, (i, j)) pairs,
+                                    in the order the list engine generates them
+        walk_masks, jump_masks: the same squares as bitboards (walk_masks are also the neighbours of the square)
+    """
+    walk_targets, jump_targets, walk_masks, jump_masks = [], [], [], []
+    for i in range(n):
+        for j in range(m):
+            walks, jumps = [], []
+            for di in range(-2, 3):
+                for dj in range(-2, 3):
+                    if (di != 0 or dj != 0) and 0 <= i + di < n and 0 <= j + dj < m:
+                        target = ((i + di) * m + j + dj, (i + di, j + dj))
+                        (jumps if abs(di) > 1 or abs(dj) > 1 else walks).append(target)
+            walk_targets.append(walks)
+            jump_targets.append(jumps)
+            walk_masks.append(sum(1 << square for square, _ in walks))
+            jump_masks.append(sum(1 << square for square, _ in jumps))
+    return walk_targets, jump_targets, walk_masks, jump_masks
+
+
+def squares_of(bitboard):
+    """
+    Returns: the squares set in a bitboard, in increasing order
+    """
+    squares = []
+    while bitboard:
+        low = bitboard & -bitboard
+        squares.append(low.bit_length() - 1)
+        bitboard ^= low
+    return squares
+
+
+class AtaxxBitboard(Ataxx):
+    """
+    Ataxx on integer bitboards: bit i * m + j of pieces[color] is set when (i, j) holds a piece of color.
+    Moves are generated from per-square walk/jump masks precomputed for the board size.
+    Plays by the same rules and exposes the same interface as Ataxx, board included (built on demand).
+    """
+
+    def __init__(self, n, m, action_encoding='legacy'):
+        self.n = n
+        self.m = m
+        self.name = 'A'
+        self.action_encoding = action_encoding
+        self.model_name = f"{self.name}{n}x{m}" if action_encoding == 'legacy' else f"{self.name}{n}x{m}-{action_encoding}"
+        self.action_sources, self.action_targets, self.action_table = action_tables(n, m, action_encoding)
+        self.player_turn = 1
+        self.score = {1: 0, -1: 0}
+        self.game_over = False
+        self.winner = 0
+        self.full = (1 << (n * m)) - 1
+        self.walk_targets, self.jump_targets, self.walk_masks, self.jump_masks = move_tables(n, m)
+        # Put the initial pieces in the corners
+        self.pieces = {1: (1 << ((n - 1) * m)) | (1 << (m - 1)), -1: 1 | (1 << (n * m - 1))}
+        # Zobrist hash of the board and side to move, updated on every change of a square or of the turn
+        self.keys, self.side_key = zobrist_keys(n, m)
+        self.square_keys = {color: [key for row in keys for key in row] for color, keys in self.keys.items()}
+        self.zobrist = board_hash(self.board, self.player_turn, n, m)
+        # State of the game before each pushed action
+        self.history = []
+
+    @property
+    def board(self):
+        board = [[0] * self.m for _ in range(self.n)]
+        for color in [1, -1]:
+            for square in squares_of(self.pieces[color]):
+                board[square // self.m][square % self.m] = color
+        return board
+
+    def clone(self):
+        newGame = AtaxxBitboard.__new__(AtaxxBitboard)
+        newGame.__dict__.update(self.__dict__)
+        newGame.pieces = dict(self.pieces)
+        newGame.score = dict(self.score)
+        newGame.history = []
+        return newGame
+
+    def push(self, action):
+        self.history.append((self.pieces[1], self.pieces[-1], self.player_turn, self.score, self.game_over, self.winner,
+                             self.zobrist))
+        self.apply_action(action)
+
+    def pop(self):
+        (self.pieces[1], self.pieces[-1], self.player_turn, self.score, self.game_over, self.winner,
+         self.zobrist) = self.history.pop()
+
+    def empty(self):
+        return self.full & ~(self.pieces[1] | self.pieces[-1])
+
+    def set_cell(self, i, j, color):
+        square = i * self.m + j
+        for old in [1, -1]:
+            if self.pieces[old] >> square & 1:
+                self.pieces[old] &= ~(1 << square)
+                self.zobrist ^= self.square_keys[old][square]
+        if color != 0:
+            self.pieces[color] |= 1 << square
+            self.zobrist ^= self.square_keys[color][square]
+
+    def apply_action(self, action, verbose=False):
+        """
+        Input:
+            action: action taken by current player
+
+        Logic:
+            If action is pass, then change turn and return
+            Elif actions is valid, then update the board and change turn
+        """
+        if self.game_over:
+            raise RuntimeError("Game over is trying to apply action")
+
+        (si, sj), (i, j) = self.decode(int(action))
+        source = si * self.m + sj
+        target = i * self.m + j
+        player = self.player_turn
+        if not (self.pieces[player] >> source & 1) or not (self.empty() >> target & 1):
+            return
+
+        if self.walk_masks[source] >> target & 1:
+            self.pieces[player] |= 1 << target
+            self.zobrist ^= self.square_keys[player][target]
+        elif self.jump_masks[source] >> target & 1:
+            self.pieces[player] ^= (1 << target) | (1 << source)
+            self.zobrist ^= self.square_keys[player][target] ^ self.square_keys[player][source]
+        else:
+            return
+        self.transform_surroundings(i, j)
+        self.update_score(verbose)
+        self.is_terminal()
+        self.change_turn()
+
+    def has_moves(self, color):
+        empty = self.empty()
+        for square in squares_of(self.pieces[color]):
+            if (self.walk_masks[square] | self.jump_masks[square]) & empty:
+                return True
+        return False
+
+    def is_terminal(self):
+        def fill_board(color):
+            empty = self.empty()
+            for square in squares_of(empty):
+                self.zobrist ^= self.square_keys[color][square]
+            self.pieces[color] |= empty
+            self.score[color] += empty.bit_count()
+        """
+        Check if the game is over (win, loss, or draw)
+        """
+        if self.pieces[1] == 0:
+            self.game_over = True
+            self.winner = -1
+        elif self.pieces[-1] == 0:
+            self.game_over = True
+            self.winner = 1
+        elif (self.pieces[1] | self.pieces[-1]) == self.full:
+            self.game_over = True
+            self.winner = 1 if self.score[1] > self.score[-1] else -1
+        elif not self.has_moves(1):
+            self.game_over = True
+            fill_board(-1)
+            self.winner = 1 if self.score[1] > self.score[-1] else -1
+        elif not self.has_moves(-1):
+            self.game_over = True
+            fill_board(1)
+            self.winner = 1 if self.score[1] > self.score[-1] else -1
+        return self.game_over
+
+    def update_score(self, verbose=False):
+        """
+        Update the score of each player
+        """
+        self.score = {1: self.pieces[1].bit_count(), -1: self.pieces[-1].bit_count()}
+        if verbose:
+            print("\nRed score: ", self.score[1])
+            print(f"Yellow score: {self.score[-1]}\n")
+
+    def clone_source(self, target):
+        walkers = self.walk_masks[target] & self.pieces[self.player_turn]
+        return (walkers & -walkers).bit_length() - 1 if walkers else target
+
+    def get_encoded_actions(self, out=None):
+        encoded_legal_actions = np.zeros(self.getActionSize(), dtype=np.int64) if out is None else np.asarray(out)
+        if out is not None:
+            encoded_legal_actions.fill(0)
+        empty = self.empty()
+        for source in squares_of(self.pieces[self.player_turn]):
+            targets = squares_of((self.walk_masks[source] | self.jump_masks[source]) & empty)
+            encoded_legal_actions[self.action_table[source, targets]] = 1
+        return encoded_legal_actions
+
+    def get_encoded_board(self, state=None, out=None):
+        if state is not None:
+            return super().get_encoded_board(state, out)
+        size = self.n * self.m
+        encoded = np.empty((3, self.n, self.m), dtype=np.float32) if out is None else np.asarray(out)
+        for layer, color in [(0, -1), (2, 1)]:
+            bits = np.frombuffer(self.pieces[color].to_bytes((size + 7) // 8, 'little'), dtype=np.uint8)
+            encoded[layer] = np.unpackbits(bits, bitorder='little')[:size].reshape(self.n, self.m)
+        encoded[1] = 1 - encoded[0] - encoded[2]
+        return encoded
+
+    def is_valid(self, i, j):
+        if 0 <= i < self.n and 0 <= j < self.m:
+            return bool(self.pieces[self.player_turn] >> (i * self.m + j) & 1)
+        return False
+
+    def get_player_pieces(self, color):
+        return [(square // self.m, square % self.m) for square in squares_of(self.pieces[color])]
+
+    def transform_surroundings(self, i, j):
+        player = self.player_turn
+        flipped = self.walk_masks[i * self.m + j] & self.pieces[-player]
+        for square in squares_of(flipped):
+            self.zobrist ^= self.square_keys[player][square] ^ self.square_keys[-player][square]
+        self.pieces[player] |= flipped
+        self.pieces[-player] &= ~flipped
+
+    def jump(self, i, j):
+        empty = self.empty()
+        return [target for square, target in self.jump_targets[i * self.m + j] if empty >> square & 1]
+
+    def walk(self, i, j):
+        empty = self.empty()
+        return [target for square, target in self.walk_targets[i * self.m + j] if empty >> square & 1]
+
+    def get_legal_actions(self, color=None):
+        """Returns: list of all possible actions from the current board state (legal moves + pass)"""
+        if color is None:
+            color = self.player_turn
+        empty = self.empty()
+        walkers = []
+        jumpers = []
+        for square in squares_of(self.pieces[color]):
+            piece = (square // self.m, square % self.m)
+            jumpers.extend((piece, target) for target_square, target in self.jump_targets[square] if empty >> target_square & 1)
+            walkers.extend((piece, target) for target_square, target in self.walk_targets[square] if empty >> target_square & 1)
+        return jumpers, walkers
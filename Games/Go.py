@@ -1,7 +1,7 @@
 import contextlib
-with contextlib.redirect_stdout(None), contextlib.redirect_stderr(None):
-    import pygame
-from boards import draw_board_go as draw_board
+from functools import lru_cache
+from .Symmetries import go_symmetries
+from .Zobrist import zobrist_keys, ko_keys, pass_keys, board_hash
 import numpy as np
 import copy
 import sys
@@ -13,6 +13,27 @@ BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
 
 
+@lru_cache(maxsize=None)
+def neighbour_table(n, m):
+    """
+    Returns: the orthogonal neighbours of every point (i * m + j) of an n x m board
+    """
+    neighbours = []
+    for i in range(n):
+        for j in range(m):
+            neighbours.append([(i + di) * m + j + dj for di, dj in [(1, 0), (-1, 0), (0, 1), (0, -1)]
+                               if 0 <= i + di < n and 0 <= j + dj < m])
+    return neighbours
+
+
+@lru_cache(maxsize=None)
+def neighbour_array(n, m):
+    """
+    Returns: (n * m, 4) array of the neighbours of every point, padded with the point n * m off the board
+    """
+    return np.array([neighbours + [n * m] * (4 - len(neighbours)) for neighbours in neighbour_table(n, m)])
+
+
 class Go:
     """
     This class describes the game of Go.
@@ -20,6 +41,9 @@ class Go:
     player2 is represented by -1 in the board
     Board is represented by a 2D matrix of size n x m
     Passes is a dictionary that keeps track if a player has passed or not in last turn
+    Stone groups are kept with union-find over the points (i * m + j) of the board: following group_parent
+    leads to the root of a group, which keeps the stones and the liberties of the whole group
+    Actions applied with push are taken back with pop, from the changes recorded while they were applied
     """
 
     def __init__(self, n, m):
@@ -28,14 +52,33 @@ class Go:
         self.name = 'G'
         self.model_name = f"{self.name}{n}x{m}"
         self.player_turn = 1
-        self.score = {1: 0, -1: 0}
+        self.komi = 5.5
+        # Stones and territory of each player, kept up to date by set_cell
+        self.score = {1: 0, -1: self.komi}
         self.board = [[0 for _ in range(m)] for _ in range(n)]
         self.game_over = False
         self.winner = 0
         self.last_action = {1: (None, None), -1: (None, None)}
-        self.last_board = None
         self.passes = {1: False, -1: False}
-        self.komi = 5.5
+        self.neighbours = neighbour_table(n, m)
+        self.points = [0] * (n * m)
+        # The points as an int8 array, with a last point off the board that is never empty
+        self.cells = np.zeros(n * m + 1, dtype=np.int8)
+        self.cells[-1] = 2
+        self.group_parent = list(range(n * m))
+        self.group_stones = {}
+        self.group_liberties = {}
+        # Point the player to move can't play because it would immediately retake a ko
+        self.ko = None
+        # State of the game before each pushed action, and the changes of the board and groups since the first one
+        self.history = []
+        self.changes = []
+        # Zobrist hash of the board, side to move, ko and passes, updated on every change of a point, of the turn,
+        # of the ko or of a pass (the game ends when the next player passes too)
+        self.keys, self.side_key = zobrist_keys(n, m)
+        self.ko_keys = ko_keys(n, m)
+        self.pass_keys = pass_keys(n, m)
+        self.zobrist = board_hash(self.board, self.player_turn, n, m)
 
     def clone(self):
         newGame = Go(self.n, self.m)
@@ -45,10 +88,106 @@ class Go:
         newGame.game_over = copy.deepcopy(self.game_over)
         newGame.winner = self.winner
         newGame.last_action = copy.deepcopy(self.last_action)
-        newGame.last_board = copy.deepcopy(self.last_board)
         newGame.passes = copy.deepcopy(self.passes)
+        newGame.points = self.points[:]
+        newGame.cells = self.cells.copy()
+        newGame.group_parent = self.group_parent[:]
+        newGame.group_stones = {root: stones[:] for root, stones in self.group_stones.items()}
+        newGame.group_liberties = {root: set(liberties) for root, liberties in self.group_liberties.items()}
+        newGame.ko = self.ko
+        newGame.zobrist = self.zobrist
         return newGame
 
+    def hash(self):
+        return self.zobrist
+
+    def set_cell(self, i, j, color):
+        point = i * self.m + j
+        if self.history:
+            self.changes.append(('cell', point, self.board[i][j]))
+        if self.board[i][j] != 0:
+            self.zobrist ^= self.keys[self.board[i][j]][i][j]
+        if color != 0:
+            self.zobrist ^= self.keys[color][i][j]
+        # Only the point and the empty points around it can change the player they count for
+        self.count_points(point, -1)
+        self.board[i][j] = color
+        self.points[point] = color
+        self.cells[point] = color
+        self.count_points(point, 1)
+
+    def set_ko(self, point):
+        if self.ko is not None:
+            self.zobrist ^= self.ko_keys[self.ko]
+        if point is not None:
+            self.zobrist ^= self.ko_keys[point]
+        self.ko = point
+
+    def set_pass(self, player, passed):
+        if self.passes[player] != passed:
+            self.zobrist ^= self.pass_keys[player]
+            self.passes[player] = passed
+
+    def count_points(self, point, sign):
+        """
+        Adds (sign 1) or takes (sign -1) the point and its neighbours to the score of the players they count for.
+        """
+        points = self.points
+        for counted in [point] + self.neighbours[point]:
+            color = points[counted]
+            if color == 0:
+                influence = 0
+                for neighbour in self.neighbours[counted]:
+                    influence += points[neighbour]
+                color = (influence > 0) - (influence < 0)
+            if color != 0:
+                self.score[color] += sign
+
+    def push(self, action):
+        """
+        Applies an action so that pop can take it back, without copying the game.
+        """
+        self.history.append((self.player_turn, self.score[1], self.score[-1], self.game_over, self.winner, self.passes[1], self.passes[-1],
+                             self.last_action[1], self.last_action[-1], self.ko, self.zobrist, len(self.changes)))
+        self.apply_action(action)
+
+    def pop(self):
+        """
+        Takes back the last action applied by push, restoring the game exactly as it was before it.
+        """
+        (self.player_turn, score, opponent_score, self.game_over, self.winner, passes, opponent_passes,
+         last_action, opponent_last_action, self.ko, self.zobrist, mark) = self.history.pop()
+        self.score[1], self.score[-1] = score, opponent_score
+        self.passes = {1: passes, -1: opponent_passes}
+        self.last_action = {1: last_action, -1: opponent_last_action}
+        while len(self.changes) > mark:
+            change = self.changes.pop()
+            if change[0] == 'cell':
+                _, point, color = change
+                self.board[point // self.m][point % self.m] = color
+                self.points[point] = color
+                self.cells[point] = color
+            elif change[0] == 'place':
+                del self.group_stones[change[1]]
+                del self.group_liberties[change[1]]
+            elif change[0] == 'union':
+                _, root, other_root, num_stones, stones, liberties, added = change
+                del self.group_stones[root][num_stones:]
+                self.group_liberties[root] -= added
+                self.group_parent[other_root] = other_root
+                self.group_stones[other_root] = stones
+                self.group_liberties[other_root] = liberties
+            elif change[0] == 'remove':
+                _, root, stones, liberties, parents = change
+                self.group_stones[root] = stones
+                self.group_liberties[root] = liberties
+                for point, parent in zip(stones, parents):
+                    self.group_parent[point] = parent
+            elif change[0] == 'add':
+                self.group_liberties[change[1]].discard(change[2])
+            elif change[0] == 'discard':
+                self.group_liberties[change[1]].add(change[2])
+
     def get_score(self):
         return self.score[-self.player_turn]
 
@@ -65,25 +204,34 @@ class Go:
             raise RuntimeError("Game over is trying to apply action")
 
         if action == self.getActionSize() - 1:
-            self.passes[self.player_turn] = True
+            self.set_pass(self.player_turn, True)
+            self.set_ko(None)
             self.change_turn()
             self.last_action[self.player_turn] = (None, None)
-            self.update_score(verbose)
+            if verbose:
+                self.update_score(verbose)
             self.is_terminal()
             return
         else:
-            self.passes = {1: False, -1: False}
+            self.set_pass(1, False)
+            self.set_pass(-1, False)
 
         i, j = self.decode(action)
 
         # if not pass
         if self.is_valid(i, j):
-            self.board[i][j] = self.player_turn
-            self.last_board = copy.deepcopy(self.board)
+            self.place_stone(i, j)
             self.last_action[self.player_turn] = (i, j)
-            self.transform_surroundings(self.player_turn)
+            captured = self.transform_surroundings(i, j)
+            # A single stone that captured a single stone and is left in atari by it can be retaken right away
+            root = self.find(i * self.m + j)
+            if len(captured) == 1 and len(self.group_stones[root]) == 1 and len(self.group_liberties[root]) == 1:
+                self.set_ko(captured[0])
+            else:
+                self.set_ko(None)
             self.change_turn()
-            self.update_score(verbose)
+            if verbose:
+                self.update_score(verbose)
             self.is_terminal()
 
     def is_terminal(self):
@@ -101,6 +249,9 @@ class Go:
         return self.game_over
 
     def update_score(self, verbose=False):
+        """
+        Counts the score of each player from scratch, which set_cell keeps up to date as the board changes
+        """
         def influence_score(x, y):
             score = 0
             for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
@@ -121,9 +272,6 @@ class Go:
                 elif score < 0:
                     self.score[-1] += 1
 
-        """
-        Update the score of each player
-        """
         self.score = {1: 0, -1: self.komi}
         # Count the number of pieces of each player
         for i in range(self.n):
@@ -154,6 +302,7 @@ class Go:
 
     def change_turn(self):
         self.player_turn *= -1
+        self.zobrist ^= self.side_key
 
     def getBoardSize(self):
         return self.n, self.m
@@ -162,88 +311,152 @@ class Go:
         """Returns: number of all possible actions"""
         return (self.n * self.m) + 1
 
-    def get_encoded_actions(self):
+    def get_symmetries(self):
         """
-        Returns: list of all encoded possible actions from the current board state (legal moves + pass).
-        Valid moves are encoded as 1, invalid moves as 0.
+        Returns: (board_index, action_index) pairs of the board symmetries, where board.flat[board_index]
+        is the transformed board and policy[action_index] its policy
         """
-        legal_actions = self.get_legal_actions()
-        encoded_legal_actions_indexes = [self.encode(action) for action in legal_actions]
-        encoded_legal_actions = [0] * self.getActionSize()
-        for index in encoded_legal_actions_indexes:
-            encoded_legal_actions[index] = 1
+        return go_symmetries(self.n, self.m)
 
+    def get_encoded_actions(self, out=None):
+        """
+        Returns: the encoded possible actions from the current board state (legal moves + pass),
+        written into out when given. Valid moves are encoded as 1, invalid moves as 0.
+        """
+        encoded_legal_actions = np.zeros(self.getActionSize(), dtype=np.int64) if out is None else np.asarray(out)
+        empty = self.cells[:-1] == 0
+        # An empty point next to another one is always a legal move, the others are checked one by one
+        open_points = empty & (self.cells[neighbour_array(self.n, self.m)] == 0).any(axis=1)
+        encoded_legal_actions[:-1] = open_points
+        for point in np.flatnonzero(empty & ~open_points).tolist():
+            encoded_legal_actions[point] = self.is_valid(point // self.m, point % self.m)
+        if self.ko is not None:
+            encoded_legal_actions[self.ko] = 0
+        encoded_legal_actions[-1] = 1
         return encoded_legal_actions
 
-    def get_encoded_board(self, state=None):
-
-        if state is None:
-            state = self.board
-        layer_1 = np.where(np.array(state) == -1, 1, 0).astype(np.float32)
-        layer_2 = np.where(np.array(state) == 0, 1, 0).astype(np.float32)
-        layer_3 = np.where(np.array(state) == 1, 1, 0).astype(np.float32)
-        return np.stack([layer_1, layer_2, layer_3]).astype(np.float32)
-
-    def does_capture(self, i, j):
-        goClone = self.clone()
-        goClone.board[i][j] = self.player_turn
-        return goClone.transform_surroundings(self.player_turn)
+    def get_encoded_board(self, state=None, out=None):
+        """
+        Returns: the (3, n, m) planes of the white stones, the empty points and the black stones,
+                 written into out (a NumPy array or CPU tensor, like a row of a batch) when given
+        """
+        board = self.cells[:-1].reshape(self.n, self.m) if state is None else np.array(state)
+        encoded = np.empty((3, self.n, self.m), dtype=np.float32) if out is None else np.asarray(out)
+        encoded[0] = board == -1
+        encoded[1] = board == 0
+        encoded[2] = board == 1
+        return encoded
+
+    def find(self, point):
+        """
+        Returns: the root of the group of the stone at point
+        """
+        # No path compression, so pop only has to undo unions (which keep the trees shallow, joining by size)
+        parent = self.group_parent
+        while parent[point] != point:
+            point = parent[point]
+        return point
+
+    def union(self, point, other):
+        root, other_root = self.find(point), self.find(other)
+        if root == other_root:
+            return
+        if len(self.group_stones[root]) < len(self.group_stones[other_root]):
+            root, other_root = other_root, root
+        stones = self.group_stones.pop(other_root)
+        liberties = self.group_liberties.pop(other_root)
+        if self.history:
+            self.changes.append(('union', root, other_root, len(self.group_stones[root]), stones, liberties,
+                                 liberties - self.group_liberties[root]))
+        self.group_parent[other_root] = root
+        self.group_stones[root].extend(stones)
+        self.group_liberties[root] |= liberties
+
+    def add_liberty(self, root, point):
+        if self.history and point not in self.group_liberties[root]:
+            self.changes.append(('add', root, point))
+        self.group_liberties[root].add(point)
+
+    def discard_liberty(self, root, point):
+        if self.history and point in self.group_liberties[root]:
+            self.changes.append(('discard', root, point))
+        self.group_liberties[root].discard(point)
 
     def is_valid(self, i, j):
-        return self.has_liberties([(i, j)]) or (self.does_capture(i, j) and self.last_board[i][j] != self.player_turn)
+        """
+        A move is valid on an empty point that isn't a ko, when the stone is left with a liberty:
+        an empty neighbour, a neighbouring group of its color with another liberty,
+        or a neighbouring group of the opponent it captures.
+        """
+        point = i * self.m + j
+        if self.points[point] != 0 or point == self.ko:
+            return False
+        for neighbour in self.neighbours[point]:
+            color = self.points[neighbour]
+            if color == 0:
+                return True
+            liberties = len(self.group_liberties[self.find(neighbour)])
+            if (color == self.player_turn and liberties > 1) or (color == -self.player_turn and liberties == 1):
+                return True
+        return False
 
     def get_legal_actions(self):
         """Returns: list of tuples of all possible actions from the current board state (legal moves + pass)"""
-        legal_moves = []
-        for i in range(self.n):
-            for j in range(self.m):
-                if self.last_action[self.player_turn] == (i, j):
-                    continue
-                if self.board[i][j] == 0:
-                    if self.is_valid(i, j):
-                        legal_moves.append((i, j))
+        legal_moves = [(i, j) for i in range(self.n) for j in range(self.m) if self.is_valid(i, j)]
         legal_moves.append((self.n - 1, self.m))
         return legal_moves
 
-    def is_empty(self, i, j):
-        return (0 <= i < self.n and 0 <= j < self.m) and self.board[i][j] == 0
-
-    def has_liberties(self, group):
-        for position in group:
-            i, j = position
-            if self.is_empty(i + 1, j) or self.is_empty(i - 1, j) or self.is_empty(i, j + 1) or self.is_empty(i, j - 1):
-                return True
-        return False
-
-    def transform_surroundings(self, color):
-        for i in range(self.n):
-            for j in range(self.m):
-                if self.board[i][j] == -color:
-                    visited = [[False for _ in range(self.m)] for _ in range(self.n)]
-                    group = []
-                    self.dfs(i, j, -color, visited, group)
-
-                    if not self.has_liberties(group):
-                        self.remove_group(group)
-                        return True
-        return False
-
-    def dfs(self, i, j, color, visited, group):
-        if i < 0 or i >= self.n or j < 0 or j >= self.m or visited[i][j] or self.board[i][j] != color:
-            return
-
-        visited[i][j] = True
-        group.append((i, j))
+    def place_stone(self, i, j):
+        """
+        Puts a stone of the player to move on (i, j), joining it with the groups of its color around it
+        and taking the point from the liberties of the opponent's groups around it.
+        """
+        point = i * self.m + j
+        self.set_cell(i, j, self.player_turn)
+        # Empty points are roots of their own, so the stone starts a group of one
+        if self.history:
+            self.changes.append(('place', point))
+        self.group_stones[point] = [point]
+        self.group_liberties[point] = {neighbour for neighbour in self.neighbours[point] if self.points[neighbour] == 0}
+        for neighbour in self.neighbours[point]:
+            if self.points[neighbour] == self.player_turn:
+                self.union(point, neighbour)
+            elif self.points[neighbour] == -self.player_turn:
+                self.discard_liberty(self.find(neighbour), point)
+        self.discard_liberty(self.find(point), point)
+
+    def transform_surroundings(self, i, j):
+        """
+        Removes the groups of the opponent left without liberties by the stone on (i, j).
 
-        self.dfs(i + 1, j, color, visited, group)
-        self.dfs(i - 1, j, color, visited, group)
-        self.dfs(i, j + 1, color, visited, group)
-        self.dfs(i, j - 1, color, visited, group)
+        Returns: the captured points
+        """
+        captured = []
+        for neighbour in self.neighbours[i * self.m + j]:
+            if self.points[neighbour] == -self.player_turn:
+                root = self.find(neighbour)
+                if len(self.group_liberties[root]) == 0:
+                    captured.extend(self.remove_group(root))
+        return captured
+
+    def remove_group(self, root):
+        """
+        Removes the group of root from the board, giving its points back as liberties to the groups around it.
 
-    def remove_group(self, group):
-        for position in group:
-            i, j = position
-            self.board[i][j] = 0
+        Returns: the removed points
+        """
+        stones = self.group_stones.pop(root)
+        liberties = self.group_liberties.pop(root)
+        if self.history:
+            self.changes.append(('remove', root, stones, liberties, [self.group_parent[point] for point in stones]))
+        for point in stones:
+            self.set_cell(point // self.m, point % self.m, 0)
+            self.group_parent[point] = point
+        for point in stones:
+            for neighbour in self.neighbours[point]:
+                if self.points[neighbour] != 0:
+                    self.add_liberty(self.find(neighbour), point)
+        return stones
 
     def play_game(self, player1, player2, verbose=False):
         """
@@ -258,10 +471,16 @@ class Go:
 
         if self.n == 7:
             size_cell = 100
-        else:
+        elif self.n == 9:
             size_cell = 70
+        else:
+            size_cell = 40
 
         if verbose:
+            # Headless games never import pygame
+            with contextlib.redirect_stdout(None), contextlib.redirect_stderr(None):
+                import pygame
+            from boards import draw_board_go as draw_board
             pygame.init()
             screen_width = self.m * size_cell  # columns * 100
             screen_height = self.n * size_cell  # rows * 100
@@ -303,9 +522,7 @@ class Go:
                             col = (mouse_pos[0] - offset) // size_cell
                             row = (mouse_pos[1] - offset) // size_cell
                             if pass_button_rect.collidepoint(mouse_pos):
-                                self.passes[self.player_turn] = True
-                                self.change_turn()
-                                self.is_terminal()
+                                self.apply_action(self.getActionSize() - 1, verbose=True)
                             elif 0 <= row < self.n and 0 <= col < self.m:
                                 if (row, col) in legal_moves:
                                     self.apply_action(self.encode((row, col)), verbose=True)
@@ -0,0 +1,54 @@
+from .AtaxxActions import action_tables
+from functools import lru_cache
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def board_symmetries(n, m):
+    """
+    Returns: the index arrays of the symmetries of an n x m board (the 8 rotations and reflections of a square
+    board, the 4 that keep the shape of a rectangular one), so that board.flat[index] is the transformed board.
+    The identity comes first.
+    """
+    squares = np.arange(n * m).reshape(n, m)
+    transforms = []
+    for flip in [False, True]:
+        for rotations in range(4):
+            transformed = np.rot90(np.fliplr(squares) if flip else squares, rotations)
+            if transformed.shape == (n, m):
+                transforms.append(np.ascontiguousarray(transformed).ravel())
+    return transforms
+
+
+@lru_cache(maxsize=None)
+def go_symmetries(n, m):
+    """
+    Returns: (board_index, action_index) pairs, where policy[action_index] is the policy of the transformed board.
+    The pass action is left in place.
+    """
+    symmetries = []
+    for board_index in board_symmetries(n, m):
+        action_index = np.append(board_index, n * m)
+        symmetries.append((board_index, action_index))
+    return symmetries
+
+
+@lru_cache(maxsize=None)
+def ataxx_symmetries(n, m, encoding='legacy'):
+    """
+    Returns: (board_index, action_index) pairs, where policy[action_index] is the policy of the transformed board.
+    Both the source and the destination square of an action are transformed.
+    The actions off the board (of the encodings by offset) are left in place.
+    """
+    sources, targets, actions = action_tables(n, m, encoding)
+    on_board = targets != -1
+    walks = on_board & (sources == -1)
+    moves = on_board & (sources != -1)
+    symmetries = []
+    for board_index in board_symmetries(n, m):
+        action_index = np.arange(len(sources))
+        action_index[moves] = actions[board_index[sources[moves]], board_index[targets[moves]]]
+        # Walks merged by target are numbered by their target
+        action_index[walks] = board_index[targets[walks]]
+        symmetries.append((board_index, action_index))
+    return symmetries
@@ -0,0 +1,311 @@
+import numpy as np
+
+
+class VectorGame:
+    """
+    B games of the same size played in lockstep, stored in stacked NumPy arrays:
+        boards: (B, n, m) with 1 and -1 for the pieces of each player, 0 for empty squares
+        player_turn, game_over, winner: (B,)
+    Every method works on all the games at once. With auto_reset, a game that ends is started again
+    right away, so apply keeps receiving an action for every game.
+    """
+
+    def __init__(self, num_games, n, m, auto_reset=True):
+        self.num_games = num_games
+        self.n = n
+        self.m = m
+        self.auto_reset = auto_reset
+        self.model_name = f"{self.name}{n}x{m}"
+        self.boards = np.zeros((num_games, n, m), dtype=np.int8)
+        self.player_turn = np.ones(num_games, dtype=np.int8)
+        self.game_over = np.zeros(num_games, dtype=bool)
+        self.winner = np.zeros(num_games, dtype=np.int8)
+        self.reset(np.ones(num_games, dtype=bool))
+
+    def reset(self, games):
+        """
+        Starts again the games selected by the boolean mask games.
+        """
+        self.boards[games] = self.initial_board()
+        self.player_turn[games] = 1
+        self.game_over[games] = False
+        self.winner[games] = 0
+
+    def initial_board(self):
+        return np.zeros((self.n, self.m), dtype=np.int8)
+
+    def getBoardSize(self):
+        return self.n, self.m
+
+    def is_terminal(self):
+        """Returns: (B,) whether each game is over (only after the last step of a game without auto_reset)"""
+        return self.game_over.copy()
+
+    def encoded_boards(self):
+        """
+        Returns: (B, 3, n, m) float32 array with the get_encoded_board planes of every game
+        """
+        return np.stack([self.boards == -1, self.boards == 0, self.boards == 1], axis=1).astype(np.float32)
+
+    def finish(self, games, winners):
+        """
+        Ends the games selected by games with the given winners, starting them again with auto_reset.
+
+        Returns: (B,) whether each game ended in this step and (B,) its winner (0 when it didn't end)
+        """
+        terminal = np.zeros(self.num_games, dtype=bool)
+        terminal[games] = True
+        step_winners = np.zeros(self.num_games, dtype=np.int8)
+        step_winners[games] = winners
+        if self.auto_reset:
+            self.reset(terminal)
+        else:
+            self.game_over |= terminal
+            self.winner[games] = winners
+        return terminal, step_winners
+
+
+class VectorAtaxx(VectorGame):
+    """
+    Ataxx by the rules of Games.Ataxx, with actions encoded as source square * n * m + destination square.
+    """
+
+    def __init__(self, num_games, n, m, auto_reset=True):
+        self.name = 'A'
+        squares = np.arange(n * m)
+        rows, cols = squares // m, squares % m
+        distance = np.maximum(abs(rows[:, None] - rows[None, :]), abs(cols[:, None] - cols[None, :]))
+        # (source, destination) pairs of a walk (the destination is next to the source) and of a jump
+        self.walks = distance == 1
+        self.jumps = distance == 2
+        self.reach = (self.walks | self.jumps).astype(np.int32)
+        super().__init__(num_games, n, m, auto_reset)
+
+    def initial_board(self):
+        board = np.zeros((self.n, self.m), dtype=np.int8)
+        board[0, 0] = board[self.n - 1, self.m - 1] = -1
+        board[self.n - 1, 0] = board[0, self.m - 1] = 1
+        return board
+
+    def getActionSize(self):
+        return self.n * self.m * self.n * self.m
+
+    def legal_mask(self):
+        """
+        Returns: (B, n * m * n * m) bool array of the legal actions of the player to move in each game
+        """
+        squares = self.boards.reshape(self.num_games, -1)
+        own = squares == self.player_turn[:, None]
+        mask = own[:, :, None] & (squares == 0)[:, None, :] & self.reach.astype(bool)[None]
+        mask[self.game_over] = False
+        return mask.reshape(self.num_games, -1)
+
+    def has_moves(self, squares, color):
+        return (((squares == color).astype(np.int32) @ self.reach > 0) & (squares == 0)).any(axis=1)
+
+    def apply(self, actions):
+        """
+        Plays an action in every game (actions of games that are over, and illegal actions, leave the game as it was).
+
+        Returns: (B,) whether each game ended with this action and (B,) its winner (0 when it didn't end)
+        """
+        size = self.n * self.m
+        squares = self.boards.reshape(self.num_games, -1)
+        source, destination = np.divmod(np.asarray(actions), size)
+        games = np.arange(self.num_games)
+        player = self.player_turn
+        valid = ((squares[games, source] == player) & (squares[games, destination] == 0)
+                 & self.reach[source, destination].astype(bool) & ~self.game_over)
+
+        squares[games[valid], destination[valid]] = player[valid]
+        jumped = valid & self.jumps[source, destination]
+        squares[games[jumped], source[jumped]] = 0
+        flipped = self.walks[destination] & (squares == -player[:, None]) & valid[:, None]
+        squares[flipped] = np.broadcast_to(player[:, None], squares.shape)[flipped]
+
+        # Same checks, in the same order, as Ataxx.is_terminal
+        red = (squares == 1).sum(axis=1)
+        yellow = (squares == -1).sum(axis=1)
+        empty = size - red - yellow
+        winners = np.zeros(self.num_games, dtype=np.int8)
+        over = valid & (red == 0)
+        winners[over] = -1
+        ended = valid & ~over & (yellow == 0)
+        winners[ended] = 1
+        over |= ended
+        ended = valid & ~over & (empty == 0)
+        winners[ended] = np.where(red > yellow, 1, -1)[ended]
+        over |= ended
+        # A player left without moves loses the empty squares to the other player
+        ended = valid & ~over & ~self.has_moves(squares, 1)
+        winners[ended] = np.where(red > yellow + empty, 1, -1)[ended]
+        over |= ended
+        ended = valid & ~over & ~self.has_moves(squares, -1)
+        winners[ended] = np.where(red + empty > yellow, 1, -1)[ended]
+        over |= ended
+
+        self.player_turn[valid] *= -1
+        return self.finish(over, winners[over])
+
+
+class VectorGo(VectorGame):
+    """
+    Go by the rules of Games.Go, with actions encoded as i * m + j and n * m for the pass.
+    Stone groups are labelled by the smallest point they hold, for all the games at once, and their labels and
+    liberties are updated around the stone of every move instead of being found again from the boards.
+    """
+
+    def __init__(self, num_games, n, m, auto_reset=True):
+        self.name = 'G'
+        self.komi = 5.5
+        points = np.arange(n * m)
+        rows, cols = points // m, points % m
+        # Orthogonal neighbours of every point, n * m (a point off the board) where there is none
+        neighbours = []
+        for di, dj in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+            inside = (0 <= rows + di) & (rows + di < n) & (0 <= cols + dj) & (cols + dj < m)
+            neighbours.append(np.where(inside, (rows + di) * m + cols + dj, n * m))
+        self.neighbours = np.stack(neighbours, axis=1)
+        self.passes = np.zeros((num_games, 2), dtype=bool)
+        # Point the player to move can't play because of a ko, -1 when there is none
+        self.ko = np.full(num_games, -1, dtype=np.int64)
+        # Label of the group of every stone (n * m for empty points) and liberties of every group, indexed by label
+        self.labels = np.full((num_games, n * m), n * m, dtype=np.int64)
+        self.liberties = np.zeros((num_games, n * m), dtype=np.int64)
+        super().__init__(num_games, n, m, auto_reset)
+
+    def reset(self, games):
+        super().reset(games)
+        self.passes[games] = False
+        self.ko[games] = -1
+        self.labels[games] = self.n * self.m
+        self.liberties[games] = 0
+
+    def getActionSize(self):
+        return self.n * self.m + 1
+
+    def padded(self, points, value):
+        # Adds the point off the board to every game, so the neighbour table can index it
+        return np.concatenate([points, np.full((len(points), 1), value, dtype=points.dtype)], axis=1)
+
+    def groups(self):
+        """
+        Returns: the label of the group of every stone (n * m for empty points)
+        and the number of liberties of every group, indexed by label
+        """
+        return self.labels, self.liberties
+
+    def count_liberties(self, points, labels):
+        """
+        Returns: the number of liberties of every group of the given points and labels of their groups, indexed by label
+        """
+        size = self.n * self.m
+        neighbour_labels = self.padded(labels, size)[:, self.neighbours]
+        # An empty point counts once for a group, however many of its stones it touches
+        counted = (neighbour_labels != size) & (points == 0)[:, :, None]
+        for k in range(1, 4):
+            for previous in range(k):
+                counted[:, :, k] &= neighbour_labels[:, :, k] != neighbour_labels[:, :, previous]
+        rows = np.arange(len(points))[:, None, None] * size
+        return np.bincount((rows + neighbour_labels)[counted], minlength=len(points) * size).reshape(len(points), size)
+
+    def neighbour_groups(self):
+        """
+        Returns: the color, the label and the liberties of the group of the 4 neighbours of every point
+        """
+        size = self.n * self.m
+        labels, liberties = self.groups()
+        neighbour_labels = self.padded(labels, size)[:, self.neighbours]
+        neighbour_liberties = np.take_along_axis(self.padded(liberties, 0), neighbour_labels.reshape(self.num_games, -1),
+                                                 axis=1).reshape(neighbour_labels.shape)
+        points = self.boards.reshape(self.num_games, -1)
+        return self.padded(points, 2)[:, self.neighbours], neighbour_labels, neighbour_liberties
+
+    def legal_mask(self, neighbour_groups=None):
+        """
+        Input:
+            neighbour_groups: what neighbour_groups returns for the current boards, when it was already called
+
+        Returns: (B, n * m + 1) bool array of the legal actions of the player to move in each game (the pass included)
+        """
+        points = self.boards.reshape(self.num_games, -1)
+        colors, _, liberties = self.neighbour_groups() if neighbour_groups is None else neighbour_groups
+        player = self.player_turn[:, None, None]
+        breathes = (colors == 0) | ((colors == player) & (liberties > 1)) | ((colors == -player) & (liberties == 1))
+        legal = (points == 0) & breathes.any(axis=2) & (np.arange(points.shape[1]) != self.ko[:, None])
+        mask = np.concatenate([legal, np.ones((self.num_games, 1), dtype=bool)], axis=1)
+        mask[self.game_over] = False
+        return mask
+
+    def scores(self):
+        """
+        Returns: (B, 2) scores of the players 1 and -1, stones and territory as Go.update_score counts them
+        """
+        points = self.boards.reshape(self.num_games, -1)
+        influence = self.padded(points, 0)[:, self.neighbours].sum(axis=2)
+        black = (points == 1) | ((points == 0) & (influence > 0))
+        white = (points == -1) | ((points == 0) & (influence < 0))
+        return np.stack([black.sum(axis=1), white.sum(axis=1) + self.komi], axis=1)
+
+    def apply(self, actions):
+        """
+        Plays an action in every game (actions of games that are over, and illegal moves, leave the board as it was).
+
+        Returns: (B,) whether each game ended with this action and (B,) its winner (0 when it didn't end)
+        """
+        size = self.n * self.m
+        actions = np.asarray(actions)
+        points = self.boards.reshape(self.num_games, -1)
+        player = self.player_turn.copy()
+        playing = ~self.game_over
+        passing = playing & (actions == size)
+        moving = playing & (actions != size)
+        # Any move other than a pass clears the passes, as in Go.apply_action
+        self.passes[moving] = False
+        self.passes[passing, np.where(player[passing] == 1, 0, 1)] = True
+        self.ko[passing] = -1
+
+        point = np.minimum(actions, size - 1)
+        neighbour_groups = self.neighbour_groups()
+        legal = self.legal_mask(neighbour_groups)[np.arange(self.num_games), point]
+        moving &= legal
+        games = np.flatnonzero(moving)
+        if len(games) > 0:
+            move_points = points[games]
+            move_player = player[games][:, None]
+            placed = point[games]
+            colors, labels, liberties = (groups[games, placed] for groups in neighbour_groups)
+            # Groups of the opponent next to the point that only breathe through it are captured
+            captured_labels = np.where((colors == -move_player) & (liberties == 1), labels, -1)
+            group_labels = self.labels[games]
+            captured = (group_labels[:, :, None] == captured_labels[:, None, :]).any(axis=2) & (move_points == -move_player)
+            move_points[np.arange(len(games)), placed] = move_player[:, 0]
+            move_points[captured] = 0
+            points[games] = move_points
+
+            # The stone joins the groups of the player around it, under the smallest label, the captured stones leave
+            friendly_labels = np.where(colors == move_player, labels, -1)
+            merged = (group_labels[:, :, None] == friendly_labels[:, None, :]).any(axis=2)
+            merged[np.arange(len(games)), placed] = True
+            merged_labels = np.minimum(placed, np.where(friendly_labels >= 0, friendly_labels, size).min(axis=1))
+            group_labels = np.where(merged, merged_labels[:, None], group_labels)
+            group_labels[captured] = size
+            self.labels[games] = group_labels
+            self.liberties[games] = self.count_liberties(move_points, group_labels)
+
+            # A single stone that captured a single stone and is left in atari by it can be retaken right away
+            empty_neighbours = (self.padded(move_points, 2)[np.arange(len(games))[:, None], self.neighbours[placed]] == 0).sum(axis=1)
+            ko = (captured.sum(axis=1) == 1) & ~(colors == move_player[:, :]).any(axis=1) & (empty_neighbours == 1)
+            self.ko[games] = np.where(ko, captured.argmax(axis=1), -1)
+
+        self.player_turn[passing | moving] *= -1
+        over = self.passes.all(axis=1) & playing
+        scores = self.scores()
+        winners = np.sign(scores[:, 0] - scores[:, 1]).astype(np.int8)
+        return self.finish(over, winners[over])
+
+
+vector_games = {
+    'A': VectorAtaxx,
+    'G': VectorGo,
+}
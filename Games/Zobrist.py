@@ -0,0 +1,53 @@
+from functools import lru_cache
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def zobrist_keys(n, m):
+    """
+    Returns: random 64-bit keys for every (color, square) of an n x m board, indexed as keys[color][i][j],
+    and the key of the second player to move. The keys are fixed for a board size so hashes are reproducible.
+    """
+    rng = np.random.default_rng(n * 1000 + m)
+    values = rng.integers(0, 2 ** 64, size=(2, n, m), dtype=np.uint64).tolist()
+    keys = {1: values[0], -1: values[1]}
+    side_key = int(rng.integers(0, 2 ** 64, dtype=np.uint64))
+    return keys, side_key
+
+
+@lru_cache(maxsize=None)
+def ko_keys(n, m):
+    """
+    Returns: random 64-bit keys for a ko on every point (i * m + j) of an n x m board, fixed for a board size
+    """
+    rng = np.random.default_rng([n, m, 1])
+    return rng.integers(0, 2 ** 64, size=n * m, dtype=np.uint64).tolist()
+
+
+@lru_cache(maxsize=None)
+def pass_keys(n, m):
+    """
+    Returns: random 64-bit keys for the pending pass of each player of an n x m board, fixed for a board size
+    """
+    rng = np.random.default_rng([n, m, 2])
+    values = rng.integers(0, 2 ** 64, size=2, dtype=np.uint64).tolist()
+    return {1: values[0], -1: values[1]}
+
+
+def board_hash(board, player_turn, n, m, ko=None, passes=None):
+    """
+    Hashes a board from scratch (with the point of its ko and the players who passed, if any), what the games keep
+    up to date incrementally.
+    """
+    keys, side_key = zobrist_keys(n, m)
+    value = side_key if player_turn == -1 else 0
+    if ko is not None:
+        value ^= ko_keys(n, m)[ko]
+    for player, passed in (passes or {}).items():
+        if passed:
+            value ^= pass_keys(n, m)[player]
+    for i in range(n):
+        for j in range(m):
+            if board[i][j] != 0:
+                value ^= keys[board[i][j]][i][j]
+    return value
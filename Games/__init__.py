@@ -1,2 +1,4 @@
+from .VectorGames import VectorAtaxx, VectorGo
+from .AtaxxBitboard import AtaxxBitboard
 from .Ataxx import Ataxx
 from .Go import Go
@@ -0,0 +1,943 @@
+from AlphaZero.SelfPlay import self_play_episode, server_self_play, connect_worker, SelfPlayWorkers, SelfPlayEpisode
+from AlphaZero.InferenceServer import InferenceServer
+from AlphaZero.ReplayBuffer import ReplayBuffer
+from AlphaZero.Inference import quantized_path
+from AlphaZero.Scheduler import detect_resources, schedule, autotune
+from AlphaZero import CNNET, MCTS, InferenceModel
+from multiprocessing import Pool
+from functools import partial
+from Games.Zobrist import zobrist_keys, board_hash
+from Games.AtaxxActions import action_encodings
+from Games import Ataxx, AtaxxBitboard, Go, VectorAtaxx, VectorGo
+from training import args
+from sys import argv
+import multiprocessing
+import subprocess
+import statistics
+import tempfile
+import shutil
+import sys
+import os
+import tracemalloc
+import resource
+import random
+import copy
+import numpy as np
+import torch
+import time
+
+args = dict(args, device=torch.device('cpu'))
+
+
+def batched_search(repeats=3):
+    """
+    Simulations per second of MCTS.search evaluating one leaf per forward pass (K=1) against K leaves per pass.
+    """
+    for game in [Ataxx(6, 6), Go(9, 9)]:
+        model = CNNET(game, args)
+        for batch_size in [1, 8, 16, 32]:
+            mcts = MCTS(game, model, dict(args, mcts_batch_size=batch_size))
+            start = time.perf_counter()
+            for _ in range(repeats):
+                mcts.search()
+            elapsed = time.perf_counter() - start
+            print(f"{game.model_name} K={batch_size}: {repeats * args['num_mcts_sims'] / elapsed:.1f} sims/sec")
+
+
+def tree_nodes(repeats=3):
+    """
+    Nodes added per second by MCTS.search with the Node object tree and with the NumPy array tree.
+    """
+    for game in [Ataxx(6, 6), Go(9, 9)]:
+        model = CNNET(game, args)
+        for tree in ['object', 'array']:
+            mcts = MCTS(game, model, dict(args, mcts_tree=tree))
+            nodes = 0
+            start = time.perf_counter()
+            for _ in range(repeats):
+                mcts.search()
+                nodes += mcts.tree.size
+            elapsed = time.perf_counter() - start
+            print(f"{game.model_name} {tree} tree: {nodes / elapsed:.1f} nodes/sec")
+
+
+def search_memory():
+    """
+    Peak traced memory and time of one MCTS.search move on Go 9x9 with 100 and 800 simulations.
+    """
+    game = Go(9, 9)
+    model = CNNET(game, args)
+    for num_mcts_sims in [100, 800]:
+        for tree in ['object', 'array']:
+            mcts = MCTS(game, model, dict(args, mcts_tree=tree, num_mcts_sims=num_mcts_sims))
+            tracemalloc.start()
+            start = time.perf_counter()
+            mcts.search()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{game.model_name} {num_mcts_sims} sims {tree} tree: {peak / 2 ** 20:.1f} MiB peak, {elapsed:.2f} s/move")
+
+
+def tree_reuse(moves=16):
+    """
+    Visits at the root per second of wall time over the first moves of a self-play game, with and without
+    keeping the subtree of the played move between searches.
+    """
+    for game in [Ataxx(6, 6), Go(9, 9)]:
+        model = CNNET(game, args)
+        for tree in ['object', 'array']:
+            for reuse_tree in [False, True]:
+                self_play_game = game.clone()
+                mcts = MCTS(self_play_game, model, dict(args, mcts_tree=tree, mcts_reuse_tree=reuse_tree))
+                visits = 0
+                start = time.perf_counter()
+                for _ in range(moves):
+                    if self_play_game.game_over:
+                        break
+                    action_prob = mcts.search()
+                    visits += mcts.tree.get_action_visits(mcts.root, game.getActionSize()).sum()
+                    action = np.random.choice(game.getActionSize(), p=action_prob)
+                    self_play_game.apply_action(action)
+                    mcts.advance(action)
+                elapsed = time.perf_counter() - start
+                print(f"{game.model_name} {tree} tree, reuse={reuse_tree}: {visits / elapsed:.1f} root visits/sec")
+
+
+def transpositions(moves=10, num_mcts_sims=(100, 800)):
+    """
+    Model evaluations per search and transposition table hit rate over the first moves of a self-play game,
+    with the table off and on, for each number of simulations per move.
+    """
+    for game in [Ataxx(4, 4), Ataxx(6, 6), Go(9, 9)]:
+        model = CNNET(game, args)
+        for sims in num_mcts_sims:
+            for table_size in [0, 100000]:
+                np.random.seed(0)
+                self_play_game = game.clone()
+                mcts = MCTS(self_play_game, model, dict(args, num_mcts_sims=sims, transposition_table_size=table_size))
+                searches = 0
+                for _ in range(moves):
+                    if self_play_game.game_over:
+                        break
+                    action_prob = mcts.search()
+                    searches += 1
+                    action = np.random.choice(game.getActionSize(), p=action_prob)
+                    self_play_game.apply_action(action)
+                    mcts.advance(action)
+                hit_rate = f", hit rate {mcts.tree.table.hit_rate() * 100:.1f}%" if table_size > 0 else ""
+                print(f"{game.model_name} {sims} sims, table size {table_size}: "
+                      f"{mcts.evaluations / searches:.1f} evaluations/search{hit_rate}")
+
+
+class CheckedGo(Go):
+    """
+    Go whose push asserts that the action is legal, counting the actions pushed.
+    """
+    pushes = 0
+
+    def clone(self):
+        game = Go.clone(self)
+        game.__class__ = CheckedGo
+        return game
+
+    def push(self, action):
+        assert self.get_encoded_actions()[action] > 0, f"illegal action {action} pushed during search"
+        CheckedGo.pushes += 1
+        Go.push(self, action)
+
+
+def go_search_legality(moves=40, num_mcts_sims=400):
+    """
+    Checks that every action MCTS.search pushes on Go 4x4 is legal, with both trees and the transposition table
+    off and on: positions differing only by their ko must not share their children.
+    """
+    game = CheckedGo(4, 4)
+    model = CNNET(game, args)
+    for tree in ['object', 'array']:
+        for table_size in [0, 100000]:
+            np.random.seed(0)
+            CheckedGo.pushes = 0
+            self_play_game = game.clone()
+            mcts = MCTS(self_play_game, model, dict(args, mcts_tree=tree, num_mcts_sims=num_mcts_sims,
+                                                    transposition_table_size=table_size))
+            for _ in range(moves):
+                if self_play_game.game_over:
+                    break
+                action_prob = mcts.search()
+                action = np.random.choice(game.getActionSize(), p=action_prob)
+                self_play_game.apply_action(action)
+                mcts.advance(action)
+            print(f"{game.model_name} {tree} tree, table size {table_size}: {CheckedGo.pushes} legal pushes")
+
+
+def random_games(game, num_games):
+    """
+    Yields every position (after the initial one) of num_games games played with random legal actions.
+    """
+    for _ in range(num_games):
+        random_game = game.clone()
+        while not random_game.game_over:
+            action = np.random.choice(np.flatnonzero(random_game.get_encoded_actions()))
+            random_game.apply_action(action)
+            yield random_game
+
+
+def zobrist(num_games=20):
+    """
+    Checks the incremental Zobrist hash against a hash from scratch over random games,
+    and compares the cost per move of updating it against hashing the board from scratch.
+    """
+    for game in [Ataxx(6, 6), Go(9, 9)]:
+        keys, side_key = zobrist_keys(game.n, game.m)
+        moves = 0
+        update_time = 0
+        scratch_time = 0
+        previous_board = copy.deepcopy(game.board)
+        for position in random_games(game, num_games):
+            start = time.perf_counter()
+            scratch_hash = board_hash(position.board, position.player_turn, game.n, game.m,
+                                     getattr(position, 'ko', None), getattr(position, 'passes', None))
+            scratch_time += time.perf_counter() - start
+            assert position.hash() == scratch_hash, f"{game.model_name}: incremental hash differs from scratch"
+
+            # Replays the incremental update of the squares changed by the move
+            changes = [(i, j, previous_board[i][j], position.board[i][j])
+                       for i in range(game.n) for j in range(game.m) if previous_board[i][j] != position.board[i][j]]
+            value = 0
+            start = time.perf_counter()
+            for i, j, old, new in changes:
+                if old != 0:
+                    value ^= keys[old][i][j]
+                if new != 0:
+                    value ^= keys[new][i][j]
+            value ^= side_key
+            update_time += time.perf_counter() - start
+
+            # The next position starts a new game after a terminal one
+            previous_board = copy.deepcopy(game.board if position.game_over else position.board)
+            moves += 1
+        print(f"{game.model_name}: {moves} positions match, incremental update {update_time / moves * 1e6:.2f} us/move, "
+              f"from scratch {scratch_time / moves * 1e6:.2f} us/move")
+
+
+def perft(game, depth):
+    """
+    Returns: the number of positions reached by playing every legal action sequence of the given length
+    (shorter when the game ends before)
+    """
+    if depth == 0 or game.game_over:
+        return 1
+    jumpers, walkers = game.get_legal_actions()
+    count = 0
+    for piece, move in jumpers + walkers:
+        child = game.clone()
+        child.apply_action(child.encode(piece, move))
+        count += perft(child, depth - 1)
+    return count
+
+
+def ataxx_bitboard(num_games=50, depth=3):
+    """
+    Checks the bitboard Ataxx engine against the list engine, by perft move counts and by playing random games
+    on both in lockstep, then compares the moves (legal move generation + apply) per second of both engines.
+    """
+    for n in [4, 5, 6]:
+        list_game, bitboard_game = Ataxx(n, n), AtaxxBitboard(n, n)
+        list_count, bitboard_count = perft(list_game, depth), perft(bitboard_game, depth)
+        assert list_count == bitboard_count, f"A{n}x{n}: perft {list_count} != {bitboard_count}"
+
+        moves = 0
+        for _ in range(num_games):
+            list_game, bitboard_game = Ataxx(n, n), AtaxxBitboard(n, n)
+            while not list_game.game_over:
+                assert list_game.get_legal_actions() == bitboard_game.get_legal_actions()
+                assert list(list_game.get_encoded_actions()) == list(bitboard_game.get_encoded_actions())
+                jumpers, walkers = list_game.get_legal_actions()
+                piece, move = (jumpers + walkers)[np.random.randint(len(jumpers + walkers))]
+                list_game.apply_action(list_game.encode(piece, move))
+                bitboard_game.apply_action(bitboard_game.encode(piece, move))
+                assert list_game.board == bitboard_game.board and list_game.score == bitboard_game.score
+                assert list_game.hash() == bitboard_game.hash()
+                assert (list_game.game_over, list_game.winner) == (bitboard_game.game_over, bitboard_game.winner)
+                assert (list_game.get_encoded_board() == bitboard_game.get_encoded_board()).all()
+                moves += 1
+        print(f"A{n}x{n}: perft({depth}) = {list_count} on both engines, {moves} random moves match")
+
+        for engine in [Ataxx, AtaxxBitboard]:
+            np.random.seed(0)
+            moves = 0
+            start = time.perf_counter()
+            for _ in range(num_games):
+                game = engine(n, n)
+                while not game.game_over:
+                    jumpers, walkers = game.get_legal_actions()
+                    piece, move = (jumpers + walkers)[np.random.randint(len(jumpers + walkers))]
+                    game.apply_action(game.encode(piece, move))
+                    moves += 1
+            elapsed = time.perf_counter() - start
+            print(f"A{n}x{n} {engine.__name__}: {moves / elapsed:.0f} moves/sec")
+
+
+def go_legal_moves(num_games=10):
+    """
+    Time of Go's legal move generation per position, over the positions of random games.
+    """
+    for n in [9, 13, 19]:
+        np.random.seed(0)
+        positions = 0
+        elapsed = 0
+        for _ in range(num_games):
+            game = Go(n, n)
+            while not game.game_over and positions < 200 * num_games:
+                start = time.perf_counter()
+                legal_actions = game.get_legal_actions()
+                elapsed += time.perf_counter() - start
+                positions += 1
+                move = legal_actions[np.random.randint(len(legal_actions))]
+                game.apply_action(game.encode(move))
+        print(f"G{n}x{n}: {elapsed / positions * 1e3:.3f} ms per legal move generation ({positions} positions)")
+
+
+def game_state(game, constants):
+    """
+    Returns: a copy of every attribute of game but the constants (tables shared by every game), arrays as lists
+    """
+    return {name: value.tolist() if isinstance(value, np.ndarray) else copy.deepcopy(value)
+            for name, value in vars(game).items() if name not in constants}
+
+
+def make_unmake(num_games=10, max_depth=8):
+    """
+    Checks that pop restores every position of random games exactly, whole state included (passes, last actions,
+    ko, Go groups and liberties, game over and winner), after random sequences of up to max_depth pushes, and
+    compares looking one move ahead with clone + apply_action against push + pop: time and memory allocated per
+    looked-ahead move.
+    """
+    for game in [Ataxx(6, 6), AtaxxBitboard(6, 6), Go(9, 9)]:
+        np.random.seed(0)
+        # Containers a clone shares with its game are tables that never change
+        constants = {name for name, value in vars(game).items()
+                     if isinstance(value, (list, dict, tuple, np.ndarray)) and getattr(game.clone(), name) is value}
+        moves = 0
+        sequences = 0
+        clone_time = push_time = 0
+        clone_bytes = push_bytes = 0
+        for position in random_games(game, num_games):
+            if position.game_over:
+                continue
+            before = game_state(position, constants)
+            depth = 0
+            length = np.random.randint(1, max_depth + 1)
+            while depth < length and not position.game_over:
+                position.push(np.random.choice(np.flatnonzero(position.get_encoded_actions())))
+                depth += 1
+            for _ in range(depth):
+                position.pop()
+            assert game_state(position, constants) == before, \
+                f"{game.model_name}: pop didn't restore the position after {depth} pushes"
+            sequences += 1
+
+            actions = np.flatnonzero(position.get_encoded_actions()).tolist()
+
+            start = time.perf_counter()
+            for action in actions:
+                child = position.clone()
+                child.apply_action(action)
+            clone_time += time.perf_counter() - start
+            start = time.perf_counter()
+            for action in actions:
+                position.push(action)
+                position.pop()
+            push_time += time.perf_counter() - start
+            assert game_state(position, constants) == before, f"{game.model_name}: pop didn't restore the position"
+
+            # Memory still held by the looked-ahead move: the whole copy against the undo record
+            tracemalloc.start()
+            for action in actions:
+                held = tracemalloc.get_traced_memory()[0]
+                child = position.clone()
+                child.apply_action(action)
+                clone_bytes += tracemalloc.get_traced_memory()[0] - held
+                del child
+                held = tracemalloc.get_traced_memory()[0]
+                position.push(action)
+                push_bytes += tracemalloc.get_traced_memory()[0] - held
+                position.pop()
+            tracemalloc.stop()
+            moves += len(actions)
+        print(f"{game.model_name} {type(game).__name__}: {sequences} push sequences restored; "
+              f"clone {clone_time / moves * 1e6:.1f} us, {clone_bytes / moves:.0f} B"
+              f" | push/pop {push_time / moves * 1e6:.1f} us, {push_bytes / moves:.0f} B per looked-ahead move")
+
+
+def vector_env(num_games=256, steps=100):
+    """
+    Checks the vectorized games against the game classes, by playing random games on both in lockstep,
+    then compares the positions per second (legal actions + apply + encoding) of num_games single games
+    against one vectorized environment of num_games games.
+    """
+    for game, vector_game in [(AtaxxBitboard(6, 6), VectorAtaxx), (Go(9, 9), VectorGo)]:
+        np.random.seed(0)
+        vector = vector_game(16, game.n, game.m)
+        games = [game.clone() for _ in range(16)]
+        for _ in range(10 * steps):
+            legal_mask = vector.legal_mask()
+            assert np.array_equal(legal_mask, np.array([single.get_encoded_actions() for single in games], dtype=bool))
+            assert np.array_equal(vector.encoded_boards(), np.stack([single.get_encoded_board() for single in games]))
+            actions = (np.random.random(legal_mask.shape) * legal_mask).argmax(axis=1)
+            terminal, winners = vector.apply(actions)
+            for i, single in enumerate(games):
+                single.apply_action(int(actions[i]))
+                assert terminal[i] == single.game_over and winners[i] == single.winner
+                if single.game_over:
+                    games[i] = game.clone()
+
+        games = [game.clone() for _ in range(num_games)]
+        start = time.perf_counter()
+        for _ in range(steps):
+            for i, single in enumerate(games):
+                legal_actions = np.flatnonzero(single.get_encoded_actions())
+                single.apply_action(int(np.random.choice(legal_actions)))
+                single.get_encoded_board()
+                if single.game_over:
+                    games[i] = game.clone()
+        single_rate = num_games * steps / (time.perf_counter() - start)
+
+        vector = vector_game(num_games, game.n, game.m)
+        start = time.perf_counter()
+        for _ in range(steps):
+            legal_mask = vector.legal_mask()
+            vector.apply((np.random.random(legal_mask.shape) * legal_mask).argmax(axis=1))
+            vector.encoded_boards()
+        vector_rate = num_games * steps / (time.perf_counter() - start)
+        print(f"{game.model_name}: {num_games} games {single_rate:.0f} positions/sec, "
+              f"vectorized {vector_rate:.0f} positions/sec")
+
+
+def inference_server(num_workers=4, num_episodes=8):
+    """
+    Self-play episodes per second of num_workers worker processes evaluating states on their own copy of the model,
+    against the same workers sending their states to an inference server, with the statistics of the server.
+    """
+    game = AtaxxBitboard(5, 5)
+    server_args = dict(args, num_mcts_sims=50, mcts_batch_size=8, inference_batch_size=64, inference_timeout=0.002)
+    model = CNNET(game, server_args)
+
+    server = InferenceServer(model, num_workers, server_args['mcts_batch_size'],
+                             server_args['inference_batch_size'], server_args['inference_timeout'])
+    free_clients = multiprocessing.Queue()
+    for client_id in range(num_workers):
+        free_clients.put(client_id)
+    server.start()
+    with Pool(num_workers, initializer=connect_worker, initargs=(server.clients, free_clients, game, server_args)) as pool:
+        start = time.perf_counter()
+        list(pool.imap_unordered(server_self_play, range(num_episodes)))
+        server_rate = num_episodes / (time.perf_counter() - start)
+    server_memory = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 2 ** 10
+    stats = server.stats()
+    server.stop()
+
+    with Pool(num_workers) as pool:
+        start = time.perf_counter()
+        list(pool.imap_unordered(partial(self_play_episode, game, server_args), [model] * num_episodes))
+        copies_rate = num_episodes / (time.perf_counter() - start)
+    copies_memory = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 2 ** 10
+
+    print(f"{game.model_name} {num_workers} workers, model copies: {copies_rate:.2f} episodes/sec, "
+          f"max worker RSS {copies_memory:.0f} MiB")
+    print(f"{game.model_name} {num_workers} workers, inference server: {server_rate:.2f} episodes/sec, "
+          f"max worker RSS {server_memory:.0f} MiB")
+    print(f"Server: {stats['requests']} requests in {stats['batches']} batches of {stats['batch_size']:.1f} states, "
+          f"queue depth {stats['queue_depth']:.1f}, latency p50 {stats['latency_p50']:.2f} ms, "
+          f"p90 {stats['latency_p90']:.2f} ms, p99 {stats['latency_p99']:.2f} ms")
+
+
+def self_play_workers(num_episodes=16):
+    """
+    Self-play episodes per second of 1, 2, 4 and 8 persistent workers, each playing args['self_play_games'] episodes
+    at once, counted from the first finished episode so the start of the workers is left out.
+    """
+    game = AtaxxBitboard(5, 5)
+    workers_args = dict(args, num_mcts_sims=50, mcts_batch_size=8, self_play_games=4)
+    model = CNNET(game, workers_args)
+    for num_workers in [1, 2, 4, 8]:
+        workers = SelfPlayWorkers(game, workers_args, model, num_workers)
+        workers.get()
+        start = time.perf_counter()
+        for _ in range(num_episodes):
+            workers.get()
+            # A training step would publish the weights here
+            workers.publish(model)
+        rate = num_episodes / (time.perf_counter() - start)
+        workers.stop()
+        print(f"{game.model_name} {num_workers} workers: {rate:.2f} episodes/sec")
+
+
+def replay_buffer(capacity=100000, batch_size=512, repeats=100):
+    """
+    Memory per million positions of the replay buffer for each board size, with the time to append an episode
+    and to sample a batch uniformly and recency-weighted.
+    """
+    for game in [Ataxx(4, 4), Ataxx(6, 6), Go(7, 7), Go(9, 9), Go(19, 19)]:
+        buffer = ReplayBuffer(game, capacity, args['replay_policy_width'])
+        per_million = buffer.nbytes / capacity * 1e6 / 2 ** 30
+        episode = [(game.get_encoded_board(), np.full(game.getActionSize(), 1 / game.getActionSize()), 1)] * 64
+        start = time.perf_counter()
+        for _ in range(repeats):
+            buffer.add_training_data(episode)
+        append = (time.perf_counter() - start) / repeats * 1e3
+        timings = []
+        for half_life in [0, capacity // 10]:
+            start = time.perf_counter()
+            for _ in range(repeats):
+                buffer.sample(batch_size, half_life)
+            timings.append((time.perf_counter() - start) / repeats * 1e3)
+        print(f"{game.model_name}: {per_million:.2f} GiB per million positions, append 64 positions {append:.3f} ms, "
+              f"sample {batch_size} uniform {timings[0]:.3f} ms, recency-weighted {timings[1]:.3f} ms")
+
+
+def replay_resume(capacity=1000, num_positions=800):
+    """
+    Checks that a persistent replay buffer resumes with its positions, and starts empty when resumed with another
+    capacity or policy width, instead of keeping positions without their policy targets.
+    """
+    game = Ataxx(4, 4)
+    directory = tempfile.mkdtemp() + '/'
+    try:
+        buffer = ReplayBuffer(game, capacity, args['replay_policy_width'], directory)
+        policies = random_policies(num_positions, game.getActionSize(), 5)
+        buffer.add(np.broadcast_to(game.get_encoded_board(), (num_positions, 3, game.n, game.m)), policies,
+                   np.ones(num_positions))
+        buffer.flush()
+        del buffer
+        resumed = ReplayBuffer(game, capacity, args['replay_policy_width'], directory)
+        assert len(resumed) == num_positions, "the buffer didn't resume with its positions"
+        del resumed
+        print(f"Resumed {num_positions} positions")
+        for change in [{'capacity': capacity // 10}, {'policy_width': 8}]:
+            resume_args = dict({'capacity': capacity, 'policy_width': args['replay_policy_width']}, **change)
+            changed = ReplayBuffer(game, resume_args['capacity'], resume_args['policy_width'], directory)
+            assert len(changed) == 0, f"the buffer resumed with {change} kept {len(changed)} positions"
+            changed.add(np.broadcast_to(game.get_encoded_board(), (10, 3, game.n, game.m)), policies[:10], np.ones(10))
+            _, (policy_indices, policy_values), _, _ = changed.sample(32)
+            assert np.allclose(changed.densify(policy_indices, policy_values).sum(axis=1), 1, atol=1e-2)
+            del changed
+            print(f"Resumed with {change}: empty buffer")
+            # Back to the first layout for the next change
+            ReplayBuffer(game, capacity, args['replay_policy_width'], directory)
+    finally:
+        shutil.rmtree(directory)
+
+
+def random_policies(num_policies, action_size, visited):
+    """
+    Returns: policies with visited non-zero entries each, like the visit distributions of a search
+    """
+    policies = np.zeros((num_policies, action_size))
+    rows = np.arange(num_policies)[:, np.newaxis]
+    policies[rows, np.argsort(np.random.random((num_policies, action_size)), axis=1)[:, :visited]] = \
+        np.random.randint(1, 20, size=(num_policies, visited))
+    return policies / np.sum(policies, axis=1, keepdims=True)
+
+
+def sparse_policies(num_positions=10 ** 6, batch_size=512, repeats=50):
+    """
+    Checks that the sparse policies of the replay buffer densify back to the dense ones, then compares
+    the size of num_positions dense and sparse policies and the time to sample and densify a batch of them.
+    """
+    for game, visited in [(Ataxx(6, 6), 40), (Go(19, 19), 80)]:
+        model = CNNET(game, args)
+        buffer = ReplayBuffer(game, num_positions, args['replay_policy_width'])
+        state = game.get_encoded_board()
+
+        # Round trip, through the buffer and the densified targets of the trainer
+        policies = random_policies(1000, game.getActionSize(), visited)
+        buffer.add(np.broadcast_to(state, (1000,) + state.shape), policies, np.ones(1000))
+        indices, values = buffer.policy_indices[:1000], buffer.policy_values[:1000]
+        assert np.allclose(buffer.densify(indices, values), policies, atol=1e-3)
+        assert np.allclose(model.densify(indices, values).numpy(), policies, atol=1e-3)
+
+        chunk = 10 ** 4
+        policies = random_policies(chunk, game.getActionSize(), visited)
+        for _ in range(len(buffer), num_positions, chunk):
+            buffer.add(np.broadcast_to(state, (chunk,) + state.shape), policies, np.ones(chunk))
+        start = time.perf_counter()
+        for _ in range(repeats):
+            indices = np.random.randint(num_positions, size=batch_size)
+            model.densify(buffer.policy_indices[indices], buffer.policy_values[indices])
+        sparse_time = (time.perf_counter() - start) / repeats * 1e3
+
+        # Dense policies of a chunk stand in for the whole buffer, the time of a batch doesn't depend on its size
+        dense = policies.astype(np.float32)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            torch.tensor(dense[np.random.randint(chunk, size=batch_size)])
+        dense_time = (time.perf_counter() - start) / repeats * 1e3
+
+        dense_size = num_positions * game.getActionSize() * 4 / 2 ** 30
+        sparse_size = (buffer.policy_indices.nbytes + buffer.policy_values.nbytes) / 2 ** 30
+        print(f"{game.model_name} {num_positions} policies: dense float32 {dense_size:.2f} GiB, "
+              f"sparse {sparse_size:.2f} GiB; batch of {batch_size}: dense {dense_time:.3f} ms, "
+              f"sparse sample and densify {sparse_time:.3f} ms")
+
+
+def action_encoding(repeats=3):
+    """
+    Policy size and simulations per second of MCTS.search on Ataxx with each action encoding.
+    """
+    for n in [4, 6]:
+        for encoding in action_encodings:
+            game = AtaxxBitboard(n, n, encoding)
+            model = CNNET(game, args)
+            mcts = MCTS(game, model, dict(args, mcts_batch_size=8))
+            start = time.perf_counter()
+            for _ in range(repeats):
+                mcts.search()
+            elapsed = time.perf_counter() - start
+            print(f"{game.model_name}: {game.getActionSize()} actions, "
+                  f"{sum(parameter.numel() for parameter in model.policy_layer().parameters())} policy head parameters, "
+                  f"{repeats * args['num_mcts_sims'] / elapsed:.1f} sims/sec")
+
+
+def augmentation(num_games=5, repeats=20):
+    """
+    Checks that every symmetry maps the legal actions of the positions of random games onto the legal actions
+    of the transformed positions, reached by playing the transformed actions, then times the augmentation
+    of the training data of a game.
+    """
+    for game in [AtaxxBitboard(6, 6), AtaxxBitboard(6, 6, 'offsets'), Ataxx(5, 5, 'clone'), Go(7, 7), Go(9, 9)]:
+        for _ in range(num_games):
+            # Start from the transformed initial positions (Ataxx starts with pieces in the corners)
+            games = []
+            board = np.array(game.board).ravel()
+            for board_index, _ in game.get_symmetries():
+                transformed = game.clone()
+                for square in np.flatnonzero(board[board_index] != board):
+                    transformed.set_cell(int(square) // game.m, int(square) % game.m, int(board[board_index][square]))
+                games.append(transformed)
+            while not games[0].is_terminal() and len(games[0].history) < 200:
+                legal = np.array(games[0].get_encoded_actions())
+                for transformed, (_, action_index) in zip(games, game.get_symmetries()):
+                    assert np.array_equal(np.array(transformed.get_encoded_actions()), legal[action_index])
+                action = np.random.choice(np.flatnonzero(legal))
+                for transformed, (_, action_index) in zip(games, game.get_symmetries()):
+                    transformed.push(int(np.argsort(action_index)[action]))
+
+        episode = SelfPlayEpisode(game, dict(args, augment_symmetries=True), CNNET(game, args))
+        policy = np.full(game.getActionSize(), 1 / game.getActionSize())
+        episode.history = [(game.get_encoded_board(), policy, 1)] * 100
+        timings = []
+        for augment in [False, True]:
+            episode.args['augment_symmetries'] = augment
+            start = time.perf_counter()
+            for _ in range(repeats):
+                training_data = episode.training_data()
+            timings.append((time.perf_counter() - start) / repeats * 1e3)
+        print(f"{game.model_name}: legal actions kept by {len(game.get_symmetries())} symmetries, 100 positions "
+              f"-> {len(training_data)} samples in {timings[1]:.2f} ms (without augmentation {timings[0]:.2f} ms)")
+
+
+def encoding(num_positions=30, repeats=20):
+    """
+    Time per position to encode the board planes and the legal actions of positions of a random game,
+    into new arrays and straight into the rows of preallocated (B, 3, n, m) and (B, actions) tensors.
+    """
+    for game in [Ataxx(6, 6), AtaxxBitboard(6, 6), Go(9, 9), Go(19, 19)]:
+        positions = []
+        position = game.clone()
+        while len(positions) < num_positions and not position.is_terminal():
+            position.apply_action(np.random.choice(np.flatnonzero(position.get_encoded_actions())))
+            positions.append(position.clone())
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            torch.tensor(np.stack([position.get_encoded_board() for position in positions]))
+            torch.tensor(np.stack([position.get_encoded_actions() for position in positions]))
+        new_arrays = (time.perf_counter() - start) / (repeats * len(positions)) * 1e6
+
+        states = torch.zeros(len(positions), 3, game.n, game.m)
+        legal_actions = torch.zeros(len(positions), game.getActionSize())
+        # NumPy views of the tensors, so each row isn't converted on every write
+        state_rows, legal_action_rows = states.numpy(), legal_actions.numpy()
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for i, position in enumerate(positions):
+                position.get_encoded_board(out=state_rows[i])
+                position.get_encoded_actions(out=legal_action_rows[i])
+        buffers = (time.perf_counter() - start) / (repeats * len(positions)) * 1e6
+        assert torch.equal(states, torch.tensor(np.stack([position.get_encoded_board() for position in positions])))
+        print(f"{game.model_name}: {new_arrays:.1f} us/position into new arrays, {buffers:.1f} us/position into buffers")
+
+
+def network_flops(model):
+    """
+    Returns: the floating point operations of a forward pass of model on one position, counting the multiplications
+    and additions of its convolutions and fully connected layers
+    """
+    flops = []
+
+    def count(layer, _, output):
+        if isinstance(layer, torch.nn.Conv2d):
+            flops.append(2 * output[0].numel() * layer.in_channels * layer.kernel_size[0] * layer.kernel_size[1])
+        else:
+            flops.append(2 * layer.in_features * layer.out_features)
+
+    hooks = [layer.register_forward_hook(count) for layer in model.modules()
+             if isinstance(layer, (torch.nn.Conv2d, torch.nn.Linear))]
+    with torch.no_grad():
+        model(torch.zeros(1, 3, model.n, model.m))
+    for hook in hooks:
+        hook.remove()
+    return sum(flops)
+
+
+def network(repeats=5):
+    """
+    Parameters, FLOPs per position and positions per second of the network in each configuration,
+    evaluating batches of 1, 32 and 256 positions on the CPU.
+    """
+    configurations = [dict(network='legacy'),
+                      dict(network='residual', residual_blocks=4, residual_channels=32, head_width=32),
+                      dict(network='residual', residual_blocks=6, residual_channels=64, head_width=64),
+                      dict(network='residual', residual_blocks=10, residual_channels=128, head_width=128)]
+    for game in [Ataxx(6, 6), Go(9, 9)]:
+        for configuration in configurations:
+            model = CNNET(game, dict(args, evaluation_cache_mb=0, **configuration))
+            parameters = sum(parameter.numel() for parameter in model.parameters())
+            rates = []
+            for batch_size in [1, 32, 256]:
+                states = np.random.random((batch_size, 3, game.n, game.m)).astype(np.float32)
+                model.evaluate(states)
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    model.evaluate(states)
+                rates.append(f"{repeats * batch_size / (time.perf_counter() - start):.0f}")
+            name = configuration['network'] if configuration['network'] == 'legacy' else \
+                f"residual {configuration['residual_blocks']}x{configuration['residual_channels']}"
+            print(f"{game.model_name} {name}: {parameters / 1e6:.2f}M parameters, "
+                  f"{network_flops(model) / 1e6:.1f} MFLOPs/position, positions/sec at batch 1/32/256: {'/'.join(rates)}")
+
+
+# Scripts of a match client up to its first move, with the model loaded as a full CNNET and for inference only
+first_move_clients = {
+    'CNNET': """
+from Games import {game}
+from AlphaZero import AlphaZeroPlayer, CNNET
+from AlphaZero.Inference import checkpoint_args
+from training import args
+import torch
+game = {game}({n}, {n})
+model = CNNET(game, checkpoint_args(torch.load({path!r}, mmap=True, weights_only=True), args))
+model.load_model({path!r})
+print(AlphaZeroPlayer(model).get_action(game))
+""",
+    'InferenceModel': """
+from Games import {game}
+from AlphaZero import AlphaZeroPlayer, InferenceModel
+from training import args
+game = {game}({n}, {n})
+print(AlphaZeroPlayer(InferenceModel(game, args, {path!r}, script={script})).get_action(game))
+""",
+}
+
+
+def first_move(repeats=5):
+    """
+    Latency from the start of a match client process to its first move, with the model loaded as a full CNNET
+    (optimizer, initial weights) and with the inference loader, traced or not, for a model saved with the
+    network of the training args. Reports the median of repeats processes.
+    """
+    directory = tempfile.mkdtemp()
+    for game_name, n in [('Go', 9), ('Ataxx', 6)]:
+        game = Go(n, n) if game_name == 'Go' else Ataxx(n, n)
+        path = os.path.join(directory, f"{game.model_name}.tar")
+        torch.save(CNNET(game, args).state_dict(), path)
+        for loader, script in [('CNNET', False), ('InferenceModel', False), ('InferenceModel', True)]:
+            code = first_move_clients[loader].format(game=game_name, n=n, path=path, script=script)
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+                               capture_output=True)
+                times.append(time.perf_counter() - start)
+            name = loader + (' traced' if script else '')
+            print(f"{game.model_name} {name}: {statistics.median(times):.2f} s to the first move")
+    shutil.rmtree(directory)
+
+
+def quantization(num_games=20, steps=200, repeats=50):
+    """
+    Accuracy and speed of the int8 export against the float32 model, for a model trained for a few steps
+    to predict the legal actions and scores of the positions of random games: policy KL divergence and value error
+    on a fifth of the positions held out of the training, latency at batch 1 and throughput at batch 256.
+    """
+    directory = tempfile.mkdtemp()
+    for game in [Ataxx(6, 6), Go(9, 9)]:
+        for configuration in [dict(network='legacy'), dict(network='residual')]:
+            model = CNNET(game, dict(args, **configuration))
+            positions = []
+            for random_game in random_games(game, num_games):
+                positions.append((random_game.get_encoded_board(), random_game.get_encoded_actions(),
+                                  random_game.get_score()))
+            states, legal_actions, scores = (np.array(array, dtype=np.float32) for array in zip(*positions))
+            policy_targets = legal_actions / np.maximum(np.sum(legal_actions, axis=1, keepdims=True), 1)
+            value_targets = np.tanh(scores / (game.n * game.m))
+            held_out = np.random.random(len(states)) < 0.2
+            for _ in range(steps):
+                batch = np.random.choice(np.flatnonzero(~held_out), 64)
+                model.train_batch(states[batch], policy_targets[batch], value_targets[batch])
+
+            path = os.path.join(directory, 'model.tar')
+            torch.save(model.state_dict(), path)
+            float32 = InferenceModel(game, dict(args, evaluation_cache_mb=0, quantized_inference=False), path)
+            int8 = InferenceModel(game, dict(args, evaluation_cache_mb=0, quantized_inference=True), path)
+            log_policies, values = float32.predict(states[held_out], legal_actions[held_out])
+            int8_log_policies, int8_values = int8.predict(states[held_out], legal_actions[held_out])
+            # The illegal actions have a probability of 0 in both
+            legal = legal_actions[held_out] > 0
+            kl = np.mean(np.sum(np.exp(log_policies) * np.where(legal, log_policies - int8_log_policies, 0), axis=1))
+            value_error = np.mean(np.abs(values - int8_values))
+
+            rates = []
+            for inference in [float32, int8]:
+                for batch_size in [1, 256]:
+                    batch = states[np.random.randint(len(states), size=batch_size)]
+                    inference.evaluate(batch)
+                    start = time.perf_counter()
+                    for _ in range(repeats):
+                        inference.evaluate(batch)
+                    rates.append(time.perf_counter() - start)
+            print(f"{game.model_name} {configuration['network']}: policy KL {kl:.2e}, value error {value_error:.2e}, "
+                  f"batch 1 {rates[0] / repeats * 1e3:.2f} -> {rates[2] / repeats * 1e3:.2f} ms, "
+                  f"batch 256 {256 * repeats / rates[1]:.0f} -> {256 * repeats / rates[3]:.0f} positions/sec")
+            os.remove(quantized_path(path))
+    shutil.rmtree(directory)
+
+
+def simulation_time(num_mcts_sims=400, repeats=3):
+    """
+    Time per MCTS simulation and the part of it spent in CNNET.predict (forward pass, masking and softmax of the
+    policies), without the evaluation cache so every leaf goes through the network, for each network at one
+    and 16 leaves per forward pass.
+    """
+    for game in [Ataxx(6, 6), Go(9, 9)]:
+        for network in ['legacy', 'residual']:
+            model = CNNET(game, dict(args, network=network, evaluation_cache_mb=0))
+            predict = model.predict
+            prediction_time = [0.0]
+
+            def timed_predict(states, legal_masks):
+                start = time.perf_counter()
+                prediction = predict(states, legal_masks)
+                prediction_time[0] += time.perf_counter() - start
+                return prediction
+
+            model.predict = timed_predict
+            times = []
+            for batch_size in [1, 16]:
+                mcts = MCTS(game, model, dict(args, num_mcts_sims=num_mcts_sims, mcts_batch_size=batch_size,
+                                              mcts_reuse_tree=False))
+                mcts.search()
+                prediction_time[0] = 0.0
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    mcts.search()
+                simulations = repeats * num_mcts_sims
+                times.append(f"{(time.perf_counter() - start) / simulations * 1e6:.0f} "
+                             f"({prediction_time[0] / simulations * 1e6:.0f} predicting)")
+            print(f"{game.model_name} {network}: {' / '.join(times)} us/simulation at batch 1 / 16")
+
+
+def list_training_steps(model, training_data, steps):
+    """
+    Training loop of CNNET.train_model before the minibatch pipeline: shuffles the list of samples and builds
+    the arrays of every batch from its tuples on the training thread.
+    """
+    random.shuffle(training_data)
+    for batchIdx in range(0, steps * model.args['batch_size'], model.args['batch_size']):
+        sample = training_data[batchIdx:batchIdx + model.args['batch_size']]
+        state, policy_targets, value_targets = zip(*sample)
+        model.train_batch(np.array(state), np.array(policy_targets), np.array(value_targets))
+
+
+def training_pipeline(num_positions=100000, steps=40, epochs=4):
+    """
+    Training steps per second on num_positions Go 9x9 positions, with the list loop train_model used to run
+    and with the minibatch pipeline, without and with a prefetching thread: for steps steps of the network
+    and for epochs epochs of batches produced without training on them (which shows the data side alone,
+    the list loop running once per epoch).
+    """
+    game = Go(9, 9)
+    policies = random_policies(num_positions, game.getActionSize(), 30)
+    training_data = [(np.random.randint(0, 2, (3, game.n, game.m)).astype(np.float32), policy,
+                      float(np.random.choice([-1, 1]))) for policy in policies]
+    epoch_steps = -(-num_positions // args['batch_size'])
+    for name, prefetch_batches in [('list loop', None), ('pipeline', 0), ('pipeline, prefetching', 2)]:
+        rates = []
+        for train in [True, False]:
+            model = CNNET(game, dict(args, train_steps=steps if train else 0, train_epochs=1 if train else epochs,
+                                     prefetch_batches=prefetch_batches or 0))
+            if not train:
+                model.train_batch = lambda state, policy_targets, value_targets: None
+            start = time.perf_counter()
+            if prefetch_batches is None:
+                for _ in range(1 if train else epochs):
+                    list_training_steps(model, training_data, steps if train else epoch_steps)
+            else:
+                model.train_model(training_data)
+            rates.append((steps if train else epochs * epoch_steps) / (time.perf_counter() - start))
+        print(f"{name}: {rates[0]:.2f} training steps/sec, {rates[1]:.0f} batches/sec without training")
+
+
+def scheduler(seconds=10):
+    """
+    Resources detected, configuration scheduled for each training mode and positions per second of the
+    configurations the autotuning calibrates for persistent workers (the serial mode isn't calibrated), for Ataxx 4x4.
+    """
+    resources = detect_resources()
+    print(f"{resources['cores']} cores of CPUs {resources['cpus']} (quota: {resources['cpu_quota']}), "
+          f"{resources['memory'] / 2 ** 30:.1f} GiB, GPU: {resources['gpu']}")
+    game = AtaxxBitboard(4, 4)
+    for mode in ['serial', 'inference_server', 'self_play_workers', 'async_training']:
+        print(f"{mode}: {schedule(game, dict(args, **{mode: True}) if mode != 'serial' else args, resources)}")
+    for mode in ['serial', 'self_play_workers']:
+        tune_args = dict(args, num_mcts_sims=25, **({mode: True} if mode != 'serial' else {}))
+        print(f"Autotuned {mode}: {autotune(game, tune_args, resources, seconds)}")
+
+
+benchmarks = {
+    'batched_search': batched_search,
+    'tree_nodes': tree_nodes,
+    'search_memory': search_memory,
+    'tree_reuse': tree_reuse,
+    'transpositions': transpositions,
+    'go_search_legality': go_search_legality,
+    'zobrist': zobrist,
+    'ataxx_bitboard': ataxx_bitboard,
+    'go_legal_moves': go_legal_moves,
+    'make_unmake': make_unmake,
+    'vector_env': vector_env,
+    'inference_server': inference_server,
+    'self_play_workers': self_play_workers,
+    'replay_buffer': replay_buffer,
+    'replay_resume': replay_resume,
+    'sparse_policies': sparse_policies,
+    'action_encoding': action_encoding,
+    'augmentation': augmentation,
+    'encoding': encoding,
+    'network': network,
+    'first_move': first_move,
+    'quantization': quantization,
+    'simulation_time': simulation_time,
+    'training_pipeline': training_pipeline,
+    'scheduler': scheduler,
+}
+
+if __name__ == "__main__":
+    if len(argv) != 2 or argv[1] not in benchmarks:
+        print('\n\nInvalid arguments. Usage: python benchmark.py <benchmark>'
+              f'\nbenchmark: {", ".join(benchmarks)}')
+        exit(0)
+
+    benchmarks[argv[1]]()
@@ -72,9 +72,12 @@ def draw_board_go(screen, game):
     if game.n == 7:
         cell_size = 100
         tam = 40
-    else:
+    elif game.n == 9:
         cell_size = 70
         tam = 28
+    else:
+        cell_size = 40
+        tam = 16
     rows, cols = game.n, game.m
     offset = (screen.get_width() - cols * cell_size) // 2
 
@@ -1,9 +1,8 @@
 import contextlib
 with contextlib.redirect_stdout(None), contextlib.redirect_stderr(None):
     import pygame
-from AlphaZero import AlphaZeroPlayer
+from AlphaZero import AlphaZeroPlayer, InferenceModel
 from Games import Ataxx, Go
-from AlphaZero import CNNET
 from training import args
 from boards import Button
 import sys
@@ -55,9 +54,8 @@ def play_game(game_name, versus_ai, n, m):
         raise NotImplementedError
     player1 = "human"
     if versus_ai:
-        model = CNNET(game, args)
-        model.load_model(model_selection(game_name, n, m))
-        player2 = AlphaZeroPlayer(model)
+        model_path = model_selection(game_name, n, m)
+        player2 = AlphaZeroPlayer(InferenceModel(game, args, model_path))
     else:
         player2 = "human"
     game.play_game(player1, player2, verbose=True)
@@ -1,5 +1,6 @@
 from AlphaZero import AlphaZero
-from Games import Ataxx, Go
+from AlphaZero.Scheduler import detect_resources, schedule, autotune
+from Games import Ataxx, AtaxxBitboard, Go
 import multiprocessing
 from sys import argv
 import torch
@@ -12,15 +13,49 @@ args = {
     'num_episodes': 100,
     'validation_episodes': 10,
     'learning_rate': 0.001,
+    'network': 'residual',
+    'residual_blocks': 6,
+    'residual_channels': 64,
+    'head_width': 64,
     'num_mcts_sims': 100,
+    'mcts_tree': 'object',
+    'mcts_reuse_tree': True,
+    # Off: searches of these games barely reach a position twice (benchmark.py transpositions)
+    'transposition_table_size': 0,
+    'mcts_batch_size': 1,
+    'virtual_loss': 1,
     'mcts_exploration_weight': 1.0,
     'dirichlet_epsilon': 0.25,
     'dirichlet_alpha': 0.3,
     'UCB_exploration_weight': 1.0,
     'batch_size': 2 ** 9,
+    'train_epochs': 1,
+    'train_steps': 0,
+    'prefetch_batches': 2,
+    'augment_symmetries': True,
+    'evaluation_cache_mb': 64,
+    'quantized_inference': False,
+    'inference_server': False,
+    'inference_batch_size': 256,
+    'inference_timeout': 0.002,
+    'self_play_workers': False,
+    'self_play_games': 4,
+    'async_training': False,
+    'train_sample_ratio': 1.0,
+    'replay_buffer_size': 100000,
+    'replay_half_life': 0,
+    'replay_policy_width': 128,
+    'replay_buffer_persistent': True,
     'best_model_dir': './best_model/',
+    'ataxx_bitboard': True,
+    'ataxx_action_encoding': 'legacy',
     'device': None,
-    'num_processes': None
+    'num_processes': None,
+    'worker_threads': None,
+    'trainer_threads': None,
+    'pin_workers': False,
+    'scheduler_autotune': False,
+    'calibration_seconds': 20
 }
 
 if __name__ == "__main__":
@@ -28,45 +63,51 @@ if __name__ == "__main__":
         print('\n\nInvalid number of arguments. Usage: python training.py <GNxM>'
               '\nG: A(Ataxx),G (Go)'
               '\nN,M for Ataxx: (4x4, 5x5, 6x6)'
-              '\nN,M for Go: (7x7, 9x9)')
+              '\nN,M for Go: (7x7, 9x9, 13x13, 19x19)')
         exit(0)
 
     game = argv[1][0]
-    boardsize = (int(argv[1][1]), int(argv[1][3]))
+    boardsize = tuple(int(size) for size in argv[1][1:].split('x'))
 
     if game == 'A':
         if boardsize[0] == boardsize[1] == 4 \
                 or boardsize[0] == boardsize[1] == 5 \
                 or boardsize[0] == boardsize[1] == 6:
-            g = Ataxx(boardsize[0], boardsize[1])
+            g = (AtaxxBitboard if args['ataxx_bitboard'] else Ataxx)(boardsize[0], boardsize[1],
+                                                                  args['ataxx_action_encoding'])
         else:
             print('\n\n For Ataxx Game: N,M must be 4x4, 5x5, 6x6.')
             exit(0)
     elif game == 'G':
-        if (boardsize[0] == boardsize[1] == 7
-                or boardsize[0] == boardsize[1] == 9):
+        if boardsize[0] == boardsize[1] and boardsize[0] in [7, 9, 13, 19]:
             g = Go(boardsize[0], boardsize[1])
         else:
-            print('\n\n For Go Game: N,M must be 7x7, 9x9.')
+            print('\n\n For Go Game: N,M must be 7x7, 9x9, 13x13, 19x19.')
             exit(0)
     else:
         print(
-            '\n\nInvalid Game. Usage: python training.py <GNxM> \nG:[A (Ataxx),G (Go)] \nG=A:(N,M = 4x4, 5x5 or 6x6), G=G:(N,M = 7x7 or 9x9)')
+            '\n\nInvalid Game. Usage: python training.py <GNxM> \nG:[A (Ataxx),G (Go)] \nG=A:(N,M = 4x4, 5x5 or 6x6), G=G:(N,M = 7x7, 9x9, 13x13 or 19x19)')
         exit(0)
 
     print("Training model for", "Ataxx" if game == "A" else "Go", "with board size", boardsize[0], "x", boardsize[1])
 
     if torch.cuda.is_available():
         args['device'] = torch.device('cuda')
-        args['num_processes'] = torch.cuda.get_device_properties(args['device']).multi_processor_count**2
         print("CUDA is available!")
         print(f"Name of the device: {torch.cuda.get_device_name(args['device'])}")
-        print(f"Number of processes being used: {args['num_processes']}")
     else:
         args['device'] = torch.device('cpu')
-        args['num_processes'] = int(multiprocessing.cpu_count())*10
         print("CUDA is not available! Using CPU.")
-        print(f"Number of processes being used: {args['num_processes']}")
+
+    resources = detect_resources()
+    print(f"Cores: {resources['cores']} of {len(resources['cpus'])} CPUs (quota: {resources['cpu_quota']}), "
+          f"memory: {resources['memory'] / 2 ** 30:.1f} GiB")
+    if args['scheduler_autotune']:
+        args.update(autotune(g, args, resources, args['calibration_seconds']))
+    else:
+        args.update(schedule(g, args, resources))
+    print(f"Number of processes being used: {args['num_processes']}, with {args['worker_threads']} threads each "
+          f"({args['trainer_threads']} for training)")
 
     model = AlphaZero(g, args)
 